@@ -0,0 +1,199 @@
+"""Benchmarks for parsing and checking contracts.
+
+    python bench.py                        # run them all, print the results
+    python bench.py -o results.json        # ..and write them out
+    python bench.py --save-baseline        # ..as the baseline to compare against
+    python bench.py --compare              # exit 1 if anything got slower
+    python bench.py -k list                # just the benchmarks with 'list' in their name
+
+Each result is the best time per operation, in seconds, over a few
+repeats. Timings depend on the machine, so make the baseline on the one
+you compare on (it's bench_baseline.json unless you say otherwise).
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import contract
+from contract import contract as contract_decorator
+
+def measure(f, min_time=0.05, repeat=3):
+    # seconds per call of f, the best of a few runs which each take at
+    # least min_time.
+    number = 1
+    while True:
+        start = time.time()
+        for _ in xrange(number):
+            f()
+        elapsed = time.time() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    best = elapsed
+    for _ in range(repeat - 1):
+        start = time.time()
+        for _ in xrange(number):
+            f()
+        best = min(best, time.time() - start)
+    return best / number
+
+benchmarks = []
+
+def benchmark(name):
+    # the function decorated sets up the benchmark and returns the thing
+    # to time.
+    def add(setup):
+        benchmarks.append((name, setup))
+        return setup
+    return add
+
+# parsing, as contracts get longer and deeper.
+
+def add_parse_benchmarks():
+    for n in [1, 5, 10, 20, 100, 1000]:
+        s = '(%s%s) -> int' % (','.join(['int'] * n), ',' if n == 1 else '')
+        benchmark('parse tuple %i' % n)(lambda s=s: lambda: contract.earley(s.translate(None, ' ')))
+    for depth in [1, 5, 10, 20]:
+        s = '(%s%s,) -> int' % ('[' * depth + 'int', ']' * depth)
+        benchmark('parse depth %i' % depth)(lambda s=s: lambda: contract.earley(s.translate(None, ' ')))
+
+add_parse_benchmarks()
+
+# decorating, with and without the contract already parsed.
+
+def f(*args):
+    return args[0] if args else None
+
+@benchmark('decorate uncached')
+def decorate_uncached():
+    def run():
+        contract.contract_cache.clear()
+        contract_decorator('(str, [int], str:int) -> str')(f)
+    return run
+
+@benchmark('decorate cached')
+def decorate_cached():
+    contract_decorator('(str, [int], str:int) -> str')(f)
+    return lambda: contract_decorator('(str, [int], str:int) -> str')(f)
+
+@benchmark('decorate in closure')
+def decorate_in_closure():
+    # like prepender in the README: the same def, decorated afresh on
+    # every call of the function around it.
+    @contract_decorator('(str,) -> (str,) -> str')
+    def prepender(s):
+        @contract_decorator('(str,) -> str')
+        def wrapper(s2):
+            return s + s2
+        return wrapper
+    return lambda: prepender('hello, ')
+
+# the cost of a call, per construct.
+
+class Base(object):
+    pass
+
+class Derived(Base):
+    pass
+
+@contract_decorator('(int,) -> int')
+def double(i):
+    return i * 2
+
+def add_call_benchmarks():
+    calls = [
+        ('plain', None, (1,)),
+        ('leaf', '(int,) -> int', (1,)),
+        ('nullable', '(int?,) -> int?', (None,)),
+        ('base', '(^Base,) -> ^Base', (Derived(),)),
+        ('tuple 1', '(int,) -> int', (1,)),
+        ('tuple 4', '(int, int, int, int) -> int', (1, 2, 3, 4)),
+        ('tuple 8', '(int, int, int, int, int, int, int, int) -> int', tuple(range(8))),
+        ('list', '([int],) -> [int]', ([1, 2, 3],)),
+        ('set', '({int},) -> {int}', (set([1, 2, 3]),)),
+        ('dict', '(str:int,) -> str:int', ({'a': 1, 'b': 2},)),
+        ('fun', '(((int,) -> int),) -> ((int,) -> int)', (double,)),
+        ]
+    for name, s, args in calls:
+        def setup(s=s, args=args):
+            g = f if s is None else contract_decorator(s)(f)
+            return lambda: g(*args)
+        benchmark('call %s' % name)(setup)
+
+add_call_benchmarks()
+
+# containers, from small to big.
+
+def add_container_benchmarks():
+    for size in [10, 100, 1000, 10 ** 4, 10 ** 5, 10 ** 6]:
+        containers = [
+            ('list', '([int],) -> [int]', lambda n: range(n)),
+            ('list of tuples', '([(int, str)],) -> [(int, str)]', lambda n: [(i, 'a') for i in range(n)]),
+            ('set', '({int},) -> {int}', lambda n: set(range(n))),
+            ('dict', '(int:str,) -> int:str', lambda n: dict((i, 'a') for i in range(n))),
+            ]
+        # (the stack engine's opt-in, but --compare should catch it
+        # getting slower too.)
+        for engine, prefix in [(None, 'container'), ('stack', 'container stack')]:
+            for name, s, make in containers:
+                # the values are made when the benchmark is run, so they
+                # don't all have to fit in memory at once.
+                def setup(s=s, make=make, size=size, engine=engine):
+                    g = contract_decorator(s, engine=engine)(f)
+                    value = make(size)
+                    return lambda: g(value)
+                benchmark('%s %s %i' % (prefix, name, size))(setup)
+
+add_container_benchmarks()
+
+def run(pattern=None, min_time=0.05, out=sys.stdout):
+    results = {}
+    for name, setup in benchmarks:
+        if pattern is not None and pattern not in name:
+            continue
+        results[name] = measure(setup(), min_time)
+        out.write('%-40s %12.3f us\n' % (name, results[name] * 1e6))
+    return results
+
+def compare(results, baseline, tolerance=0.25):
+    """Returns a list of the benchmarks that are more than tolerance
+    slower than in baseline, as (name, before, after)."""
+    slower = []
+    for name in sorted(results):
+        if name in baseline and results[name] > baseline[name] * (1 + tolerance):
+            slower.append((name, baseline[name], results[name]))
+    return slower
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark parsing and checking contracts.')
+    parser.add_argument('-k', dest='pattern', help='only run benchmarks whose names contain this')
+    parser.add_argument('-o', '--output', help='write the results here, as json')
+    parser.add_argument('--baseline', default='bench_baseline.json', help='the baseline to save or compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the baseline')
+    parser.add_argument('--compare', action='store_true', help='exit 1 if anything is slower than the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='how much slower counts as slower (default 0.25)')
+    parser.add_argument('--min-time', type=float, default=0.05, help='how long to run each benchmark for, at least')
+    args = parser.parse_args(argv)
+    results = run(args.pattern, args.min_time)
+    outputs = [args.output] if args.output else []
+    if args.save_baseline:
+        outputs.append(args.baseline)
+    for path in outputs:
+        with open(path, 'w') as out:
+            json.dump(results, out, indent=1, sort_keys=True)
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print 'no baseline at %s, make one with --save-baseline' % args.baseline
+            return 1
+        with open(args.baseline) as f:
+            slower = compare(results, json.load(f), args.tolerance)
+        for name, before, after in slower:
+            print '%s is slower: %.3f us, was %.3f us' % (name, after * 1e6, before * 1e6)
+        return 1 if slower else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,21 @@
+import bisect
+import collections
+import copy
+import fnmatch
+import hashlib
+import itertools
+import logging
+import math
+import operator
+import Queue
+import os
+import random
 import re
+import threading
+import time
+import types
+import warnings
+import weakref
 
 try:
     import termcolor
@@ -20,15 +37,34 @@ class AmbiguousContract(Exception):
     pass
 
 class InternalFailedContract(Exception):
+    # args are what was expected (a span of the contract) and a
+    # description of what was got instead, see describe().
     pass
 
 class FailedContract(Exception):
-    pass
+    """args are what was expected, a description of what was got
+    instead (see describe()), 'input' or 'output', and where the
+    contract is (or None, to leave that out of the message). The
+    message is only put together if someone asks for it. Raised with
+    any other args, it's like any other exception."""
+
+    @property
+    def message(self):
+        if len(self.args) != 4:
+            return Exception.__str__(self)
+        expected, got, which, where = self.args
+        message = 'expected %s is %s, but got %s' % (which, expected, describe(got))
+        if where is not None:
+            message = '%s: %s' % (where, message)
+        return message
+
+    def __str__(self):
+        return self.message
 
 class InternalContractError(Exception):
     pass
 
-t_type = ('type', r'[A-Za-z]+')
+t_type = ('type', r'[A-Za-z_][A-Za-z0-9_]*')
 t_arrow = ('arrow', r'->')
 t_lparen = ('lparen', r'\(')
 t_rparen = ('rparen', r'\)')
@@ -40,6 +76,9 @@ t_rbrace = ('rbrace', r'}')
 t_colon = ('colon', r':')
 t_question = ('question', r'\?')
 t_caret = ('caret', r'\^')
+t_langle = ('langle', r'<')
+t_rangle = ('rangle', r'>')
+t_number = ('number', r'[0-9]+')
 
 root = 'fun'
 rules = [
@@ -48,7 +87,9 @@ rules = [
     ('fixed_tup', (t_lparen, t_rparen)),
     ('fixed_tup', (t_lparen, 'typ', t_comma, t_rparen)),
     ('fixed_tup', (t_lparen, 'typ', t_comma, 'typ', 'more_fixed_tup', t_rparen)),
-    ('more_fixed_tup', (t_comma, 'typ', 'more_fixed_tup')),
+    # left-recursive, which Earley parses in linear time (right recursion
+    # is quadratic); tuple_elements() puts the elements back in order.
+    ('more_fixed_tup', ('more_fixed_tup', t_comma, 'typ')),
     ('more_fixed_tup', ()),
 
     ('list', (t_lbrack, 'typ', t_rbrack)),
@@ -57,10 +98,16 @@ rules = [
 
     ('dict', ('typ', t_colon, 'typ')),
 
+    # types with parameters: array<d>, ndarray<float64>, ndarray<float64,2>,
+    # iter<int>.
+    ('generic', (t_type, t_langle, 'typ', t_rangle)),
+    ('generic', (t_type, t_langle, 'typ', t_comma, t_number, t_rangle)),
+
     ('t', ('fixed_tup',)),
     ('t', ('list',)),
     ('t', ('set',)),
     ('t', ('dict',)),
+    ('t', ('generic',)),
     ('t', (t_type,)),
     ('t', (t_lparen, 'typ', t_rparen)),
     ('t', ('fun',)),
@@ -71,99 +118,343 @@ rules = [
     ('typ', (t_caret, t_type)),
     ]
 
+# Parse trees are made of Nodes (a rule's lhs and the trees of its rhs)
+# and Tokens. They're hash-consed: there's only one of each distinct
+# tree alive at a time, shared by every contract it's part of. A
+# node's span, the part of the contract it was parsed from, isn't kept
+# on the node but put back together from its tokens the first time
+# it's wanted (which is only when compiling, or in check_value), and
+# remembered in node_spans for as long as the node's alive.
+
+class Token(object):
+    __slots__ = ('term', 'token', '__weakref__')
+    lhs = None
+
+    def __init__(self, term, token):
+        self.term = term
+        self.token = token
+
+    @property
+    def span(self):
+        return self.token
+
+    def __repr__(self):
+        return '%s:%s' % (self.term, self.token)
+
+class Node(object):
+    __slots__ = ('lhs', 'rhs', '__weakref__')
+    term = None
+
+    def __init__(self, lhs, rhs):
+        self.lhs = lhs
+        self.rhs = rhs
+
+    @property
+    def span(self):
+        span = node_spans.get(self)
+        if span is None:
+            # bottom up, with a stack rather than by recursing, since
+            # trees can be deeper than Python's stack.
+            stack = [self]
+            while stack:
+                node = stack[-1]
+                missing = [child for child in node.rhs if child.term is None and child not in node_spans]
+                if missing:
+                    stack.extend(missing)
+                    continue
+                stack.pop()
+                node_spans[node] = ''.join(node_spans[child] if child.term is None else child.token for child in node.rhs)
+            span = node_spans[self]
+        return span
+
+    def __repr__(self):
+        return '%s(%s)' % (self.lhs, ' '.join(map(repr, self.rhs)))
+
+# (no lock: two threads racing to make the same tree only means it
+# isn't shared.)
+parse_nodes = weakref.WeakValueDictionary()
+node_spans = weakref.WeakKeyDictionary()
+
+def make_token(term, token):
+    t = parse_nodes.get((term, token))
+    if t is None:
+        t = parse_nodes[(term, token)] = Token(term, token)
+    return t
+
+def make_node(lhs, rhs):
+    # rhs is already made of shared trees, so comparing it by identity
+    # (which tuples of objects without __eq__ do) compares structure.
+    node = parse_nodes.get((lhs, rhs))
+    if node is None:
+        node = parse_nodes[(lhs, rhs)] = Node(lhs, rhs)
+    return node
+
 def rule_matcher(rule, lhs, *rhs):
-    if rule['lhs'] == lhs:
-        if len(rule['rhs']) == len(rhs):
-            for rhs_1, rhs_2 in zip(rhs, rule['rhs']):
+    if rule.lhs == lhs:
+        if len(rule.rhs) == len(rhs):
+            for rhs_1, rhs_2 in zip(rhs, rule.rhs):
                 if type(rhs_1) == tuple:
-                    if rhs_2.get('term') != rhs_1[0]:
+                    if rhs_2.term != rhs_1[0]:
                         return False
                 elif type(rhs_1) == str:
-                    if rhs_2.get('lhs') != rhs_1:
+                    if rhs_2.lhs != rhs_1:
                         return False
                 else:
                     assert False
             return True
     return False
 
-def earley(s):
-    # initialize chart
-    chart = [[] for _ in range(len(s) + 1)]
+def index_grammar(rules):
+    # which rules each nonterminal expands to, by index into rules.
+    by_lhs = collections.defaultdict(list)
+    for i, (r_lhs, r_rhs) in enumerate(rules):
+        by_lhs[r_lhs].append(i)
+    # one regex that picks out any terminal, so we can tokenize in one pass.
+    terms = []
     for r_lhs, r_rhs in rules:
-        if r_lhs == root:
-            chart[0].append({
-                    'begin': 0,
-                    'lhs': r_lhs,
-                    'uncompleted_rhs': tuple(r_rhs),
-                    'rhs': (),
-                    'span': ''
-                    })
+        for r in r_rhs:
+            if type(r) == tuple and r not in terms:
+                terms.append(r)
+    token_re = re.compile('|'.join('(?P<%s>%s)' % term for term in terms))
+    return dict(by_lhs), token_re
+
+grammar = index_grammar(rules)
+
+def tokenize(s):
+    _, token_re = grammar
+    tokens = []
+    i = 0
+    while i < len(s):
+        m = token_re.match(s, i)
+        if m is None:
+            return None
+        tokens.append((m.lastgroup, m.group(0)))
+        i = m.end()
+    return tokens
+
+def earley(s, root=root):
+    by_lhs, _ = grammar
+    tokens = tokenize(s)
+    if tokens is None:
+        return []
+    # A state is (rule index, how much of the rule's rhs has been
+    # seen, the column it began in, the column it's in). For each
+    # state we remember every way we got there, as (previous state,
+    # child) pairs, where the child is either a token index or a
+    # completed state; that's enough to rebuild every parse tree
+    # afterwards, ambiguous ones included.
+    chart = [[] for _ in range(len(tokens) + 1)]
+    derivations = {}
+    # states in each column waiting on a given nonterminal, and states
+    # which completed without consuming anything.
+    waiting = [collections.defaultdict(list) for _ in chart]
+    completed_empty = [collections.defaultdict(list) for _ in chart]
+    def add(state, derivation):
+        if state not in derivations:
+            derivations[state] = []
+            chart[state[3]].append(state)
+        if derivation is not None and derivation not in derivations[state]:
+            derivations[state].append(derivation)
+    def advance(state, child):
+        r, dot, begin, _ = state
+        end = child + 1 if type(child) == int else child[3]
+        add((r, dot + 1, begin, end), (state, child))
+    for r in by_lhs.get(root, []):
+        add((r, 0, 0, 0), None)
     # fill in each column
     for i in range(len(chart)):
-        while True:
-            new_states = list(chart[i])
-            for state in chart[i]:
-                # predict?
-                if state['uncompleted_rhs']:
-                    for r_lhs, r_rhs in rules:
-                        if state['uncompleted_rhs'][0] == r_lhs: # this only works because of the tuple-wrapping for terms.
-                            new_state = {
-                                'begin': i,
-                                'lhs': r_lhs,
-                                'uncompleted_rhs': tuple(r_rhs),
-                                'rhs': (),
-                                'span': ''
-                                }
-                            if new_state not in new_states:
-                                new_states.append(new_state)
+        # the column can only grow while we're working on it, so it
+        # doubles as its own worklist.
+        j = 0
+        while j < len(chart[i]):
+            state = chart[i][j]
+            j += 1
+            r, dot, begin, _ = state
+            r_lhs, r_rhs = rules[r]
+            if dot < len(r_rhs):
+                next_symbol = r_rhs[dot]
                 # scan?
-                if state['uncompleted_rhs'] and type(state['uncompleted_rhs'][0]) is tuple:
-                    term, term_re = state['uncompleted_rhs'][0]
-                    m = re.match(term_re, s[i:])
-                    if m:
-                        new_state = {
-                            'begin': state['begin'],
-                            'lhs': state['lhs'],
-                            'uncompleted_rhs': state['uncompleted_rhs'][1:],
-                            'rhs': state['rhs'] + ({'term': term, 'token': m.group(0)},),
-                            'span': state['span'] + m.group(0)
-                            }
-                        chart[i + len(m.group(0))].append(new_state)
-                # complete?
-                if not state['uncompleted_rhs']:
-                    for previous_state in chart[state['begin']]:
-                        if previous_state['uncompleted_rhs'] and previous_state['uncompleted_rhs'][0] == state['lhs']:
-                            new_state = {
-                                'begin': previous_state['begin'],
-                                'lhs': previous_state['lhs'],
-                                'uncompleted_rhs': tuple(previous_state['uncompleted_rhs'][1:]),
-                                'rhs': previous_state['rhs'] + (state,),
-                                'span': previous_state['span'] + state['span']
-                                }
-                            if new_state not in new_states:
-                                new_states.append(new_state)
-            # process this set of states again if it's gotten bigger.
-            if len(new_states) > len(chart[i]):
-                chart[i] = new_states
+                if type(next_symbol) == tuple:
+                    if i < len(tokens) and tokens[i][0] == next_symbol[0]:
+                        advance(state, i)
+                # predict?
+                else:
+                    waiting[i][next_symbol].append(state)
+                    for completed in completed_empty[i][next_symbol]:
+                        advance(state, completed)
+                    for predicted in by_lhs.get(next_symbol, []):
+                        add((predicted, 0, i, i), None)
+            # complete?
+            else:
+                if begin == i:
+                    completed_empty[i][r_lhs].append(state)
+                for previous_state in list(waiting[begin][r_lhs]):
+                    advance(previous_state, state)
+    # rebuild the parse trees of the complete states in the last column:
+    # for each state, every possible tuple of children for the part of
+    # the rule seen so far. Trees can be deeper (or, for tuples, longer)
+    # than Python's stack, so the states they depend on are worked out
+    # first with a stack of our own rather than by recursing.
+    trees_memo = {}
+    def trees(top):
+        stack = [top]
+        while stack:
+            state = stack[-1]
+            if state in trees_memo:
+                stack.pop()
+            elif state[1] == 0:
+                trees_memo[state] = [()]
+                stack.pop()
             else:
-                break
-    # return the last column of states after we pretty it up a bit.
-    complete = filter(lambda state: state['begin'] == 0 and not state['uncompleted_rhs'] and state['lhs'] == root, chart[-1])
-    def pretty(state):
-        if 'term' in state:
-            return {'term': state['term'], 'token': state['token']}
+                needed = [s for derivation in derivations[state] for s in derivation
+                          if type(s) != int and s not in trees_memo]
+                if needed:
+                    stack.extend(needed)
+                    continue
+                trees_memo[state] = [
+                    left + (child_tree,)
+                    for previous_state, child in derivations[state]
+                    for left in trees_memo[previous_state]
+                    for child_tree in child_trees(child)]
+                stack.pop()
+        return trees_memo[top]
+    nodes_memo = {}
+    def child_trees(child):
+        if type(child) == int:
+            return [make_token(*tokens[child])]
+        if child not in nodes_memo:
+            nodes_memo[child] = [make_node(rules[child[0]][0], rhs) for rhs in trees(child)]
+        return nodes_memo[child]
+    complete = [state for state in chart[-1] if state[2] == 0 and rules[state[0]][0] == root and state[1] == len(rules[state[0]][1])]
+    return [tree for state in complete for tree in child_trees(state)]
+
+# Parse trees, and the failures found checking values against them, can
+# be deeper than Python's stack, so what's worked out from them bottom
+# up is written as generators and run by unwind() with a stack of its
+# own. parts(item, *args) yields (parts, item) for each thing it wants
+# worked out first, and is sent back the result; finally it yields
+# (None, its own result). (StackCheckers does the same for checking
+# values, see run_ops().)
+
+def unwind(parts, item, *args):
+    stack = [parts(item, *args)]
+    sent = None
+    while True:
+        parts, item = stack[-1].send(sent)
+        if parts is not None:
+            stack.append(parts(item, *args))
+            sent = None
         else:
-            return {'lhs': state['lhs'], 'rhs': tuple(pretty(rhs) for rhs in state['rhs']), 'span': state['span']}
-    return map(pretty, complete)
+            stack.pop()
+            if not stack:
+                return item
+            sent = item
+
+# Contracts that mean the same thing can be written differently (e.g.
+# `(str,)->str` and `((str),)->str`), so to compare them we write them
+# out in a canonical form: no redundant parentheses, and parentheses
+# wherever leaving them out would make the contract ambiguous.
+
+def kind(schema):
+    # what a typ (or t) is, as far as parenthesizing it goes.
+    while True:
+        if rule_matcher(schema, 'typ', 't', t_question):
+            return 'nullable'
+        elif rule_matcher(schema, 'typ', t_caret, t_type):
+            return 'base'
+        elif rule_matcher(schema, 'typ', 't'):
+            schema = schema.rhs[0]
+        elif rule_matcher(schema, 't', t_lparen, 'typ', t_rparen):
+            schema = schema.rhs[1]
+        elif rule_matcher(schema, 't', t_type):
+            return 'type'
+        else:
+            return schema.rhs[0].lhs
+
+def parenthesized(form, schema, kinds):
+    # schema's canonical form, in parentheses if it's one of kinds.
+    if kind(schema) in kinds:
+        return '(%s)' % form
+    return form
+
+def canonical(schema):
+    return unwind(canonical_parts, schema)
+
+def canonical_parts(schema):
+    lhs, rhs = schema.lhs, schema.rhs
+    if lhs == 'fun':
+        args = yield canonical_parts, rhs[0]
+        output = yield canonical_parts, rhs[2]
+        yield None, args + '->' + parenthesized(output, rhs[2], ('dict', 'nullable'))
+    elif rule_matcher(schema, 'fixed_tup', t_lparen, t_rparen):
+        yield None, '()'
+    elif rule_matcher(schema, 'fixed_tup', t_lparen, 'typ', t_comma, t_rparen):
+        elem = yield canonical_parts, rhs[1]
+        yield None, '(%s,)' % elem
+    elif lhs == 'fixed_tup':
+        elems = []
+        for e in tuple_elements(schema):
+            elems.append((yield canonical_parts, e))
+        yield None, '(%s)' % ','.join(elems)
+    elif lhs == 'list':
+        elem = yield canonical_parts, rhs[1]
+        yield None, '[%s]' % elem
+    elif lhs == 'set':
+        elem = yield canonical_parts, rhs[1]
+        yield None, '{%s}' % elem
+    elif lhs == 'dict':
+        key = yield canonical_parts, rhs[0]
+        value = yield canonical_parts, rhs[2]
+        yield None, parenthesized(key, rhs[0], ('dict', 'fun')) + ':' + parenthesized(value, rhs[2], ('dict', 'fun', 'nullable'))
+    elif lhs == 'generic':
+        param = yield canonical_parts, rhs[2]
+        ndim = ',' + rhs[4].token if len(rhs) == 6 else ''
+        yield None, '%s<%s%s>' % (rhs[0].token, param, ndim)
+    elif rule_matcher(schema, 't', t_type):
+        yield None, rhs[0].token
+    elif rule_matcher(schema, 't', t_lparen, 'typ', t_rparen):
+        form = yield canonical_parts, rhs[1]
+        yield None, form
+    elif rule_matcher(schema, 'typ', 't', t_question):
+        t = yield canonical_parts, rhs[0]
+        yield None, parenthesized(t, rhs[0], ('dict', 'fun', 'nullable', 'base')) + '?'
+    elif rule_matcher(schema, 'typ', t_caret, t_type):
+        yield None, '^' + rhs[1].token
+    else:
+        form = yield canonical_parts, rhs[0]
+        yield None, form
+
+class Contract(object):
+    """A contract, in canonical form. There's only ever one of these
+    alive for each canonical form (see intern_contract()), so they can
+    be compared with `is`."""
+
+    def __init__(self, canonical):
+        self.canonical = canonical
+
+    def __str__(self):
+        return self.canonical
+
+    def __repr__(self):
+        return 'Contract(%r)' % self.canonical
+
+interned_contracts = weakref.WeakValueDictionary()
+interned_lock = threading.Lock()
+
+def intern_contract(canonical):
+    with interned_lock:
+        interned = interned_contracts.get(canonical)
+        if interned is None:
+            interned = interned_contracts[canonical] = Contract(canonical)
+        return interned
 
 def check_value(schema, value):
     # fun
     if rule_matcher(schema, 'fun', 'fixed_tup', t_arrow, 'typ'):
-        expected_contract = '%s->%s' % (schema['rhs'][0]['span'], schema['rhs'][2]['span'])
+        expected_contract = '%s->%s' % (schema.rhs[0].span, schema.rhs[2].span)
         if type(value).__name__ == 'function':
             if getattr(value, '__contract__', None) is not None:
-                # this is so horrible, i am a horrible
-                if value.__contract__ != expected_contract:
+                if value.__contract__ is not intern_contract(canonical(schema)):
                     raise InternalFailedContract(expected_contract, red(value.__contract__))
             else:
                 raise InvalidContract('expected a contract-wrapped method') #maybe??????
@@ -172,30 +463,32 @@ def check_value(schema, value):
 
     # t
     elif rule_matcher(schema, 't', 'fixed_tup'):
-        check_value(schema['rhs'][0], value)
+        check_value(schema.rhs[0], value)
     elif rule_matcher(schema, 't', 'list'):
-        check_value(schema['rhs'][0], value)
+        check_value(schema.rhs[0], value)
     elif rule_matcher(schema, 't', 'set'):
-        check_value(schema['rhs'][0], value)
+        check_value(schema.rhs[0], value)
     elif rule_matcher(schema, 't', 'dict'):
-        check_value(schema['rhs'][0], value)
+        check_value(schema.rhs[0], value)
+    elif rule_matcher(schema, 't', 'generic'):
+        check_value(schema.rhs[0], value)
     elif rule_matcher(schema, 't', t_type):
-        expect_type = schema['rhs'][0]['token']
+        expect_type = schema.rhs[0].token
         if expect_type != type(value).__name__:
             raise InternalFailedContract(expect_type, red(type(value).__name__))
     elif rule_matcher(schema, 't', t_lparen, 'typ', t_rparen):
-        check_value(schema['rhs'][1], value)
+        check_value(schema.rhs[1], value)
     elif rule_matcher(schema, 't', 'fun'):
-        check_value(schema['rhs'][0], value)
+        check_value(schema.rhs[0], value)
 
     # typ
     elif rule_matcher(schema, 'typ', 't'):
-        check_value(schema['rhs'][0], value)
+        check_value(schema.rhs[0], value)
     elif rule_matcher(schema, 'typ', 't', t_question):
         if value is not None:
-            check_value(schema['rhs'][0], value)
+            check_value(schema.rhs[0], value)
     elif rule_matcher(schema, 'typ', t_caret, t_type):
-        expect_base_type = schema['rhs'][1]['token']
+        expect_base_type = schema.rhs[1].token
         def find_base_classes(o):
             bases = set([b.__name__ for b in o.__bases__])
             for b in o.__bases__:
@@ -209,76 +502,71 @@ def check_value(schema, value):
         if type(value) == list:
             for v in value:
                 try:
-                    check_value(schema['rhs'][1], v)
+                    check_value(schema.rhs[1], v)
                 except InternalFailedContract, e:
                     # unlike tuples, shortcircuit, because lists are supposed to be homogenous.
-                    raise InternalFailedContract(schema['span'], '[..' + red(e.args[1]) + '..]')
+                    raise InternalFailedContract(schema.span, '[..' + red(describe(e.args[1])) + '..]')
         else:
-            raise InternalFailedContract(schema['span'], red(type(value).__name__))
+            raise InternalFailedContract(schema.span, red(type(value).__name__))
 
     # set
     elif rule_matcher(schema, 'set', t_lbrace, 'typ', t_rbrace):
         if type(value) == set:
             for v in value:
                 try:
-                    check_value(schema['rhs'][1], v)
+                    check_value(schema.rhs[1], v)
                 except InternalFailedContract, e:
                     # just like for lists, we shortcircuit, because sets are homogenous.
-                    raise InternalFailedContract(schema['span'], '{..' + red(e.args[1]) + '..}')
+                    raise InternalFailedContract(schema.span, '{..' + red(describe(e.args[1])) + '..}')
         else:
-            raise InternalFailedContract(schema['span'], red(type(value).__name__))
+            raise InternalFailedContract(schema.span, red(type(value).__name__))
 
     # dict
     elif rule_matcher(schema, 'dict', 'typ', t_colon, 'typ'):
         if type(value) == dict:
             for k, v in value.iteritems():
                 is_okay = True
-                key_span = schema['rhs'][0]['span']
-                value_span = schema['rhs'][2]['span']
+                key_span = schema.rhs[0].span
+                value_span = schema.rhs[2].span
                 try:
-                    check_value(schema['rhs'][0], k)
+                    check_value(schema.rhs[0], k)
                 except InternalFailedContract, e:
                     # " " " dicts are homogenous.
-                    key_span = red(e.args[1])
+                    key_span = red(describe(e.args[1]))
                     is_okay = False
                 try:
-                    check_value(schema['rhs'][2], v)
+                    check_value(schema.rhs[2], v)
                 except InternalFailedContract, e:
-                    value_span = red(e.args[1])
+                    value_span = red(describe(e.args[1]))
                     is_okay = False
                 if not is_okay:
-                    raise InternalFailedContract(schema['span'], '{..' + key_span + ':' + value_span + '..}')
+                    raise InternalFailedContract(schema.span, '{..' + key_span + ':' + value_span + '..}')
         else:
-            raise InternalFailedContract(schema['span'], red(type(value).__name__))
+            raise InternalFailedContract(schema.span, red(type(value).__name__))
+
+    # generic: these are only checked compiled.
+    elif schema.lhs == 'generic':
+        compile_schema(schema)(value)
 
     # tuple
     elif rule_matcher(schema, 'fixed_tup', t_lparen, t_rparen):
         if value != ():
-            raise InternalFailedContract(schema['span'], type(value).__name__)
+            raise InternalFailedContract(schema.span, type(value).__name__)
     elif rule_matcher(schema, 'fixed_tup', t_lparen, 'typ', t_comma, t_rparen):
         try:
             value[0]
         except IndexError:
-            raise InternalFailedContract(schema['span'], '(_,)')
+            raise InternalFailedContract(schema.span, '(_,)')
         try:
-            check_value(schema['rhs'][1], value[0])
+            check_value(schema.rhs[1], value[0])
         except InternalFailedContract, e:
-            raise InternalFailedContract(schema['span'], '(' + red(e.args[1]) + ',)')
+            raise InternalFailedContract(schema.span, '(' + red(describe(e.args[1])) + ',)')
     elif rule_matcher(schema, 'fixed_tup', t_lparen, 'typ', t_comma, 'typ', 'more_fixed_tup', t_rparen):
-        expected = [schema['rhs'][1], schema['rhs'][3]]
-        p = schema['rhs'][4]
-        while True:
-            if rule_matcher(p, 'more_fixed_tup', t_comma, 'typ', 'more_fixed_tup'):
-                expected.append(p['rhs'][1])
-                p = p['rhs'][2]
-            elif rule_matcher(p, 'more_fixed_tup'):
-                break
-            else:
-                raise InternalContractError('the parsetree is fucked right here')
+        expected = tuple_elements(schema)
         if type(value) != tuple:
-            raise InternalFailedContract(schema['span'], type(value).__name__)
+            raise InternalFailedContract(schema.span, type(value).__name__)
         if len(value) != len(expected):
-            raise InternalFailedContract(schema['span'], '(' + ('_,' * len(value)) + ')')
+            raise InternalFailedContract(schema.span, '(' + ('_,' * len(value)) + ')')
         # complicated error reporting follows
         matches = True
         discovered = []
@@ -286,21 +574,993 @@ def check_value(schema, value):
             try:
                 check_value(e, v)
             except InternalFailedContract, e:
-                discovered.append(e.args[1])
+                discovered.append(describe(e.args[1]))
                 matches = False
             else:
-                discovered.append(e['span'])
+                discovered.append(e.span)
         if not matches:
-            raise InternalFailedContract(schema['span'], '(' + ','.join(discovered) + ',)')
+            raise InternalFailedContract(schema.span, '(' + ','.join(discovered) + ',)')
 
     # we're fucked!
     else:
         import pprint
         raise InternalContractError('check_value() is incompletely defined (no case for %s)!' % pprint.PrettyPrinter().pformat(schema))
 
-def contract(s, debug=False, show_line=True):
-    # parse it.
-    s = s.translate(None, ' \t\n')
+class LRUCache(object):
+    """A bounded, thread-safe mapping which throws away whatever was
+    least recently used once it holds more than maxsize entries."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            self.evict()
+
+    def evict(self):
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def resize(self, maxsize):
+        with self.lock:
+            self.maxsize = maxsize
+            self.evict()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'size': len(self.entries), 'maxsize': self.maxsize}
+
+class ContainerPolicy(object):
+    """How much of each list, set and dict to check: all of it (the
+    default), the first few elements, a few elements picked at
+    random, or as many elements as can be checked in some number of
+    seconds."""
+
+    def __init__(self, first=None, sample=None, seconds=None):
+        if [first, sample, seconds].count(None) < 2:
+            raise ValueError('give at most one of first, sample or seconds')
+        self.first = first
+        self.sample = sample
+        self.seconds = seconds
+
+    def select(self, value, items=False):
+        # the elements (or items, for a dict) of value to check, and
+        # whether they might not be all of them. That's only False when
+        # they're all of them; with a deadline it's a Deadline, which
+        # is true once time's run out.
+        elements = value.iteritems() if items else value
+        if self.first is not None:
+            return itertools.islice(elements, self.first), len(value) > self.first
+        elif self.sample is not None:
+            if len(value) <= self.sample:
+                return elements, False
+            elif type(value) == list:
+                return [value[i] for i in random.sample(xrange(len(value)), self.sample)], True
+            else:
+                return reservoir_sample(elements, self.sample), True
+        elif self.seconds is not None:
+            deadline = Deadline(elements, self.seconds)
+            return deadline, deadline
+        else:
+            return elements, False
+
+class Deadline(object):
+    """Elements, until some number of seconds after they start being
+    looked at. True if time ran out before they all were."""
+
+    def __init__(self, elements, seconds):
+        self.elements = elements
+        self.seconds = seconds
+        self.cut_short = False
+
+    def __iter__(self):
+        deadline = time.time() + self.seconds
+        for i, element in enumerate(self.elements):
+            # looking at the clock costs about as much as checking an int.
+            if i % 64 == 63 and time.time() > deadline:
+                self.cut_short = True
+                return
+            yield element
+
+    def __nonzero__(self):
+        return self.cut_short
+
+def reservoir_sample(elements, k):
+    # k of elements picked at random, without copying them all. This is
+    # Li's algorithm L, which skips over the elements it won't pick in
+    # islice()s rather than looking at each one.
+    elements = iter(elements)
+    sample = list(itertools.islice(elements, k))
+    w = math.exp(math.log(1.0 - random.random()) / k)
+    while True:
+        skip = int(math.log(1.0 - random.random()) / math.log(1.0 - w)) if w < 1.0 else 0
+        for element in itertools.islice(elements, skip, skip + 1):
+            sample[random.randrange(k)] = element
+            break
+        else:
+            return sample
+        w *= math.exp(math.log(1.0 - random.random()) / k)
+
+# the policy used by contracts that weren't given their own; None means
+# check everything.
+container_policy = {'policy': None}
+full = ContainerPolicy()
+
+def set_container_policy(policy=None):
+    container_policy['policy'] = policy
+
+def partial_note(partial):
+    return '(partial)' if partial else ''
+
+# Failures mostly get caught and handled without anyone looking at
+# them, so the checkers don't write out what they got instead of what
+# they expected, they describe it with a string or a tuple like
+# ('list', <description of the bad element>, partial). describe()
+# turns that into the words only if they're needed. Describers are
+# unwind()'s parts, since a failure is as deep as the value it's in.
+
+describers = {}
+
+def describes(kind):
+    def register(f):
+        describers[kind] = f
+        return f
+    return register
+
+def describe(got):
+    return unwind(described, got)
+
+def described(got):
+    if type(got) != tuple:
+        return said(str(got))
+    return describers[got[0]](*got[1:])
+
+def said(words):
+    yield None, words
+
+@describes('red')
+def describe_red(got):
+    words = yield described, got
+    yield None, red(words)
+
+@describes('list')
+def describe_list(got, partial):
+    words = yield described, got
+    yield None, '[..' + red(words) + '..]' + partial_note(partial)
+
+@describes('set')
+def describe_set(got, partial):
+    words = yield described, got
+    yield None, '{..' + red(words) + '..}' + partial_note(partial)
+
+@describes('dict')
+def describe_dict(got_key, got_value, key_span, value_span, partial):
+    if got_key is not None:
+        key_span = red((yield described, got_key))
+    if got_value is not None:
+        value_span = red((yield described, got_value))
+    yield None, '{..' + key_span + ':' + value_span + '..}' + partial_note(partial)
+
+@describes('array')
+def describe_array(typecode):
+    yield None, red('array<%s>' % typecode)
+
+@describes('ndarray')
+def describe_ndarray(dtype, ndim):
+    yield None, red('ndarray<%s,%i>' % (dtype, ndim))
+
+@describes('iter')
+def describe_iter(index, got):
+    words = yield described, got
+    yield None, 'iter<..%i:' % index + red(words) + '..>'
+
+@describes('arity')
+def describe_arity(n):
+    yield None, '(' + ('_,' * n) + ')'
+
+@describes('single')
+def describe_single(got):
+    words = yield described, got
+    yield None, '(' + red(words) + ',)'
+
+@describes('tuple')
+def describe_tuple(failures, spans):
+    discovered = list(spans)
+    for i, got in failures:
+        discovered[i] = yield described, got
+    yield None, '(' + ','.join(discovered) + ',)'
+
+# The checkers below do the same work as check_value(), but are built
+# once per contract: compile_schema() resolves which rule each node of
+# the parse tree came from ahead of time, and hands back a tree of small
+# closures which only know about the spans they need for error
+# messages. check_value() is kept around as the reference
+# implementation.
+
+# Leaf checkers remember their verdict for each type they've seen,
+# keyed by the type itself rather than its name, so two classes with
+# the same name (or a class and its redefinition) are told apart. The
+# caches are thrown away once they get to verdict_cache_size, in case
+# classes keep getting made.
+
+verdict_cache_size = 256
+
+def remember(cache, t, verdict):
+    if len(cache) >= verdict_cache_size:
+        cache.clear()
+    cache[t] = verdict
+    return verdict
+
+# the names of all the base classes of each class.
+base_names_cache = {}
+
+def base_names(cls):
+    names = base_names_cache.get(cls)
+    if names is None:
+        names = set()
+        for b in cls.__bases__:
+            names.add(b.__name__)
+            names.update(base_names(b))
+        names = remember(base_names_cache, cls, frozenset(names))
+    return names
+
+# Checkers that only look at the name of the value's type say which
+# names they accept in type_names, so that containers of them can be
+# checked in one pass in C (see all_named()).
+
+def type_checker(expect_type):
+    verdicts = {}
+    def check(value):
+        t = type(value)
+        verdict = verdicts.get(t)
+        if verdict is None:
+            verdict = remember(verdicts, t, expect_type == t.__name__)
+        if not verdict:
+            raise InternalFailedContract(expect_type, ('red', t.__name__))
+    check.type_names = frozenset([expect_type])
+    return check
+
+def nullable_checker(check_t):
+    def check(value):
+        if value is not None:
+            check_t(value)
+    if getattr(check_t, 'type_names', None) is not None:
+        check.type_names = check_t.type_names | frozenset(['NoneType'])
+    if getattr(check_t, 'wrap', None) is not None:
+        check.wrap = lambda value, fail: value if value is None else check_t.wrap(value, fail)
+    if hasattr(check_t, 'strict'):
+        check.strict = nullable_checker(check_t.strict)
+    return check
+
+def base_checker(expect_base_type):
+    verdicts = {}
+    def check(value):
+        t = type(value)
+        verdict = verdicts.get(t)
+        if verdict is None:
+            verdict = remember(verdicts, t, expect_base_type in base_names(t))
+        if not verdict:
+            raise InternalFailedContract(expect_base_type, ('red', t.__name__))
+    return check
+
+def fun_checker(expected_contract, canonical):
+    expected = intern_contract(canonical)
+    def check(value):
+        if type(value).__name__ == 'function':
+            if getattr(value, '__contract__', None) is not None:
+                if value.__contract__ is not expected:
+                    raise InternalFailedContract(expected_contract, ('red', value.__contract__))
+            else:
+                raise InvalidContract('expected a contract-wrapped method')
+        else:
+            raise InternalFailedContract(expected_contract, ('red', type(value).__name__))
+    return check
+
+# Contracts can opt in to having plain functions passed where a fun
+# contract is expected (autowrap=True): the function is let through and
+# then swapped, by wrap(), for the function wrapped in the contract it
+# was expected to have, with the same options as the contract it was
+# passed through. The wrapper is made once per function, contract and
+# options, and kept on the function itself (a weak-keyed cache would
+# keep the function alive, since the wrapper refers to it). Containers
+# can't swap their elements, so they use the checker's strict version,
+# which doesn't let plain functions through; so do the checkers of
+# anything containing one.
+
+def autowrap_fun_checker(check, canonical, options):
+    key = (intern_contract(canonical),) + tuple(sorted(options.items()))
+    def plain(value):
+        return type(value).__name__ == 'function' and getattr(value, '__contract__', None) is None
+    def check_or_let_through(value):
+        if not plain(value):
+            check(value)
+    def wrap(value, fail):
+        if not plain(value):
+            return value
+        wrappers = value.__dict__.setdefault('__autowrapped__', {})
+        wrapper = wrappers.get(key)
+        if wrapper is None:
+            wrapper = wrappers.setdefault(key, contract(canonical, **options)(value))
+        return wrapper
+    check_or_let_through.wrap = wrap
+    check_or_let_through.strict = check
+    return check_or_let_through
+
+def strict(check):
+    return getattr(check, 'strict', check)
+
+def all_named(values, type_names):
+    for t in set(itertools.imap(type, values)):
+        if t.__name__ not in type_names:
+            return False
+    return True
+
+def no_wrapping(*check_elems):
+    if any(getattr(c, 'wrap', None) is not None for c in check_elems):
+        raise InvalidContract('iter<> can only be used for arguments, return values and the elements of tuples and iter<>s')
+
+# If the elements are all of a type the element checker accepts, the
+# containers don't bother with the element checker, except to work out
+# what went wrong.
+
+def list_checker(check_elem, span, policy=None):
+    check_elem = strict(check_elem)
+    no_wrapping(check_elem)
+    type_names = getattr(check_elem, 'type_names', None)
+    def check(value):
+        if type(value) == list:
+            elements, partial = (policy or container_policy['policy'] or full).select(value)
+            if type_names is not None:
+                if partial is not False:
+                    elements = list(elements)
+                if all_named(elements if partial is not False else value, type_names):
+                    return
+            for v in elements:
+                try:
+                    check_elem(v)
+                except InternalFailedContract, e:
+                    e.args = (span, ('list', e.args[1], bool(partial)))
+                    raise
+        else:
+            raise InternalFailedContract(span, ('red', type(value).__name__))
+    return check
+
+def set_checker(check_elem, span, policy=None):
+    check_elem = strict(check_elem)
+    no_wrapping(check_elem)
+    type_names = getattr(check_elem, 'type_names', None)
+    def check(value):
+        if type(value) == set:
+            elements, partial = (policy or container_policy['policy'] or full).select(value)
+            if type_names is not None:
+                if partial is not False:
+                    elements = list(elements)
+                if all_named(elements if partial is not False else value, type_names):
+                    return
+            for v in elements:
+                try:
+                    check_elem(v)
+                except InternalFailedContract, e:
+                    e.args = (span, ('set', e.args[1], bool(partial)))
+                    raise
+        else:
+            raise InternalFailedContract(span, ('red', type(value).__name__))
+    return check
+
+def dict_checker(check_key, check_val, span, key_span, value_span, policy=None):
+    check_key, check_val = strict(check_key), strict(check_val)
+    no_wrapping(check_key, check_val)
+    key_names = getattr(check_key, 'type_names', None)
+    value_names = getattr(check_val, 'type_names', None)
+    def check(value):
+        if type(value) == dict:
+            items, partial = (policy or container_policy['policy'] or full).select(value, items=True)
+            if key_names is not None and value_names is not None:
+                if partial is not False:
+                    items = list(items)
+                    keys, values = itertools.imap(operator.itemgetter(0), items), itertools.imap(operator.itemgetter(1), items)
+                else:
+                    keys, values = value.iterkeys(), value.itervalues()
+                if all_named(keys, key_names) and all_named(values, value_names):
+                    return
+            for k, v in items:
+                got_key = got_value = None
+                try:
+                    check_key(k)
+                except InternalFailedContract, e:
+                    got_key = e.args[1]
+                try:
+                    check_val(v)
+                except InternalFailedContract, e:
+                    got_value = e.args[1]
+                if got_key is not None or got_value is not None:
+                    raise InternalFailedContract(span, ('dict', got_key, got_value, key_span, value_span, bool(partial)))
+        else:
+            raise InternalFailedContract(span, ('red', type(value).__name__))
+    return check
+
+# array.array and numpy arrays carry the type of their elements
+# around with them, so checking them doesn't involve the elements.
+
+def array_checker(typecode, span):
+    def check(value):
+        if type(value).__name__ != 'array':
+            raise InternalFailedContract(span, ('red', type(value).__name__))
+        if value.typecode != typecode:
+            raise InternalFailedContract(span, ('array', value.typecode))
+    return check
+
+def ndarray_checker(dtype, ndim, span):
+    def check(value):
+        if type(value).__name__ != 'ndarray':
+            raise InternalFailedContract(span, ('red', type(value).__name__))
+        if value.dtype.name != dtype or (ndim is not None and value.ndim != ndim):
+            raise InternalFailedContract(span, ('ndarray', value.dtype.name, value.ndim))
+    return check
+
+# Iterators can't be checked up front without using them up, so an
+# iter<> checker only makes sure it's been given something iterable,
+# and leaves the rest to its wrap(), which swaps the value for a
+# CheckedIterator. Checkers of things which can contain an iter<> have
+# a wrap() too, which puts back together whatever they're checking with
+# its iter<>s swapped out. fail() reports a failure found later on.
+
+class CheckedIterator(object):
+
+    def __init__(self, iterator, check_elem, span, fail):
+        self.iterator = iterator
+        self.check_elem = check_elem
+        self.wrap_elem = getattr(check_elem, 'wrap', None)
+        self.span = span
+        self.fail = fail
+        self.index = 0
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self.checked(next(self.iterator))
+
+    def checked(self, value):
+        self.index += 1
+        try:
+            self.check_elem(value)
+        except InternalFailedContract, e:
+            self.fail(InternalFailedContract(self.span, ('iter', self.index - 1, e.args[1])))
+        if self.wrap_elem is not None:
+            value = self.wrap_elem(value, self.fail)
+        return value
+
+class CheckedGenerator(CheckedIterator):
+    # a generator can be given values and exceptions too, and whatever
+    # it yields back is checked like anything else it yields.
+
+    def send(self, value):
+        return self.checked(self.iterator.send(value))
+
+    def throw(self, *args):
+        return self.checked(self.iterator.throw(*args))
+
+    def close(self):
+        self.iterator.close()
+
+class CheckedIterable(object):
+    # something which can be iterated over more than once, like a list,
+    # and still can be: each time round gets its own CheckedIterator.
+    # Everything else is passed through to it.
+
+    def __init__(self, iterable, check_elem, span, fail):
+        self.iterable = iterable
+        self.check_elem = check_elem
+        self.span = span
+        self.fail = fail
+
+    def __iter__(self):
+        return CheckedIterator(iter(self.iterable), self.check_elem, self.span, self.fail)
+
+    def __len__(self):
+        return len(self.iterable)
+
+    def __getattr__(self, name):
+        return getattr(self.iterable, name)
+
+def iter_checker(check_elem, span):
+    def check(value):
+        if not hasattr(value, '__iter__') and not hasattr(value, '__getitem__'):
+            raise InternalFailedContract(span, ('red', type(value).__name__))
+    def wrap(value, fail):
+        iterator = iter(value)
+        if iterator is not value:
+            return CheckedIterable(value, check_elem, span, fail)
+        elif isinstance(iterator, types.GeneratorType):
+            return CheckedGenerator(iterator, check_elem, span, fail)
+        return CheckedIterator(iterator, check_elem, span, fail)
+    check.wrap = wrap
+    return check
+
+# Tuple checkers keep their elements' checkers in elems, so that
+# contract() can check a function's arguments one at a time, without
+# packing them into a tuple first. elems_failure() makes the failure
+# the tuple checker would have, from the elements' (index, failure)s.
+
+def unit_checker(span):
+    def check(value):
+        if value != ():
+            raise InternalFailedContract(span, type(value).__name__)
+    check.elems = ()
+    return check
+
+def single_checker(check_elem, span):
+    def check(value):
+        try:
+            value[0]
+        except IndexError:
+            raise InternalFailedContract(span, '(_,)')
+        try:
+            check_elem(value[0])
+        except InternalFailedContract, e:
+            e.args = (span, ('single', e.args[1]))
+            raise
+    if getattr(check_elem, 'wrap', None) is not None:
+        check.wrap = lambda value, fail: (check_elem.wrap(value[0], fail),) + tuple(value[1:])
+    if hasattr(check_elem, 'strict'):
+        check.strict = single_checker(check_elem.strict, span)
+    check.elems = (check_elem,)
+    check.elems_failure = lambda failures: InternalFailedContract(span, ('single', failures[0][1]))
+    return check
+
+def tuple_checker(check_elems, spans, span):
+    spans = tuple(spans)
+    arity = len(check_elems)
+    def check(value):
+        if type(value) != tuple:
+            raise InternalFailedContract(span, type(value).__name__)
+        if len(value) != arity:
+            raise InternalFailedContract(span, ('arity', len(value)))
+        # complicated error reporting follows
+        failures = None
+        for i, check_elem in enumerate(check_elems):
+            try:
+                check_elem(value[i])
+            except InternalFailedContract, e:
+                if failures is None:
+                    failures = []
+                failures.append((i, e.args[1]))
+        if failures is not None:
+            raise InternalFailedContract(span, ('tuple', failures, spans))
+    wraps = [getattr(check_elem, 'wrap', None) for check_elem in check_elems]
+    if any(wraps):
+        def wrap(value, fail):
+            return tuple(v if w is None else w(v, fail) for w, v in zip(wraps, value))
+        check.wrap = wrap
+    if any(hasattr(check_elem, 'strict') for check_elem in check_elems):
+        check.strict = tuple_checker(map(strict, check_elems), spans, span)
+    check.elems = tuple(check_elems)
+    check.elems_failure = lambda failures: InternalFailedContract(span, ('tuple', failures, spans))
+    return check
+
+# Checking the same big tuple over and over is a waste of time if it
+# can't have changed since last time. Contracts can opt in to
+# remembering which (deeply immutable) tuples each of their tuple
+# checkers has already passed: the tuples are kept alive by the cache,
+# so their ids can't be reused while they're in it.
+
+immutable_types = frozenset([int, long, float, complex, bool, str, unicode, type(None)])
+
+def deeply_immutable(value):
+    if type(value) in immutable_types:
+        return True
+    elif type(value) in (tuple, frozenset):
+        return all(deeply_immutable(v) for v in value)
+    else:
+        return False
+
+memo_cache = LRUCache(4096)
+memo_tokens = itertools.count()
+# (so that None, which isn't a tuple, is never mistaken for a hit.)
+memo_miss = object()
+
+def memo_checker(check):
+    token = next(memo_tokens)
+    def memo_check(value):
+        key = (token, id(value))
+        if memo_cache.get(key, memo_miss) is not value:
+            check(value)
+            if deeply_immutable(value):
+                memo_cache.put(key, value)
+    # memoizing a contract's input tuple is pointless, it's new every call.
+    memo_check.unmemoized = check
+    if getattr(check, 'wrap', None) is not None:
+        memo_check.wrap = check.wrap
+    if hasattr(check, 'strict'):
+        memo_check.strict = check.strict
+    return memo_check
+
+class Checkers(object):
+    """The checker constructors above, with the options a contract was
+    given filled in. compile_schema() builds checkers out of whatever
+    it's given as k; at runtime that's one of these, but precompile.py
+    hands it something which writes out the equivalent Python source
+    instead."""
+
+    engine = 'recursive'
+
+    def __init__(self, containers=None, memo=False, autowrap=False, show_line=True):
+        self.containers = containers
+        self.memo = memo
+        self.autowrap = autowrap
+        # (only the wrappers made by autowrapping need show_line.)
+        self.show_line = show_line if autowrap else None
+
+    def options(self):
+        return (self.containers, self.memo, self.autowrap, self.show_line, self.engine)
+
+    def wrapper_options(self):
+        # what autowrapped functions are wrapped with: the same as the
+        # contract they were passed through.
+        return {'containers': self.containers, 'memo': self.memo, 'autowrap': True,
+                'show_line': self.show_line, 'engine': self.engine}
+
+    type_checker = staticmethod(type_checker)
+    nullable_checker = staticmethod(nullable_checker)
+    base_checker = staticmethod(base_checker)
+
+    def fun_checker(self, expected_contract, canonical):
+        check = fun_checker(expected_contract, canonical)
+        return autowrap_fun_checker(check, canonical, self.wrapper_options()) if self.autowrap else check
+    unit_checker = staticmethod(unit_checker)
+
+    def single_checker(self, check_elem, span):
+        check = single_checker(check_elem, span)
+        return memo_checker(check) if self.memo else check
+
+    def tuple_checker(self, check_elems, spans, span):
+        check = tuple_checker(check_elems, spans, span)
+        return memo_checker(check) if self.memo else check
+
+    array_checker = staticmethod(array_checker)
+    ndarray_checker = staticmethod(ndarray_checker)
+    iter_checker = staticmethod(iter_checker)
+
+    def list_checker(self, check_elem, span):
+        return list_checker(check_elem, span, self.containers)
+
+    def set_checker(self, check_elem, span):
+        return set_checker(check_elem, span, self.containers)
+
+    def dict_checker(self, check_key, check_val, span, key_span, value_span):
+        return dict_checker(check_key, check_val, span, key_span, value_span, self.containers)
+
+checkers = Checkers()
+
+# The checkers above check what's inside a value by calling checkers
+# for its parts, so a deeply nested value means deeply nested Python
+# calls (and, deep enough, a RuntimeError). StackCheckers makes
+# checkers for containers of containers which keep the parts still to
+# be checked on a stack of their own instead. Each is an Op, whose
+# frames() is a generator that yields (checker, part) for each part it
+# wants checked and is sent back what went wrong with it (the args of
+# its InternalFailedContract, or None), and finally yields (None, what
+# went wrong with the whole thing, or None); a generator isn't resumed
+# once it's failed. run_ops() drives them.
+# Containers of plain types are left as the usual checkers, since
+# they're no deeper than they look.
+
+class Op(object):
+
+    def __init__(self, frames, *args):
+        self.frames = frames
+        self.args = args
+
+    def __call__(self, value):
+        run_ops(self, value)
+
+def run_ops(op, value):
+    stack = [op.frames(value, *op.args)]
+    sent = None
+    while True:
+        check, part = stack[-1].send(sent)
+        if check is None:
+            stack.pop()
+            if not stack:
+                if part is not None:
+                    raise InternalFailedContract(*part)
+                return
+            sent = part
+        elif type(check) is Op:
+            stack.append(check.frames(part, *check.args))
+            sent = None
+        else:
+            try:
+                check(part)
+                sent = None
+            except InternalFailedContract, e:
+                sent = e.args
+
+def nullable_frames(value, check_t):
+    if value is None:
+        yield None, None
+    else:
+        failed = yield check_t, value
+        yield None, failed
+
+def selected_elements(value, policy, type_names, items=False):
+    # (elements to check, partial), as the container checkers work it
+    # out, or None if they're all of a type that's known to be fine.
+    elements, partial = (policy or container_policy['policy'] or full).select(value, items)
+    if type_names is not None:
+        if partial is not False:
+            elements = list(elements)
+        if all_named(elements if partial is not False else value, type_names):
+            return None
+    return elements, partial
+
+def sequence_frames(value, check_elem, span, policy, container_type, kind):
+    if type(value) != container_type:
+        yield None, (span, ('red', type(value).__name__))
+    selected = selected_elements(value, policy, getattr(check_elem, 'type_names', None))
+    if selected is not None:
+        elements, partial = selected
+        for v in elements:
+            failed = yield check_elem, v
+            if failed is not None:
+                yield None, (span, (kind, failed[1], bool(partial)))
+    yield None, None
+
+def dict_frames(value, check_key, check_val, span, key_span, value_span, policy):
+    if type(value) != dict:
+        yield None, (span, ('red', type(value).__name__))
+    # (no bulk check, since one of check_key and check_val is an Op.)
+    items, partial = (policy or container_policy['policy'] or full).select(value, items=True)
+    for k, v in items:
+        failed_key = yield check_key, k
+        failed_value = yield check_val, v
+        if failed_key is not None or failed_value is not None:
+            yield None, (span, ('dict', failed_key and failed_key[1], failed_value and failed_value[1], key_span, value_span, bool(partial)))
+    yield None, None
+
+def single_frames(value, check_elem, span):
+    try:
+        first = value[0]
+    except IndexError:
+        yield None, (span, '(_,)')
+    failed = yield check_elem, first
+    yield None, failed and (span, ('single', failed[1]))
+
+def tuple_frames(value, check_elems, spans, span):
+    if type(value) != tuple:
+        yield None, (span, type(value).__name__)
+    if len(value) != len(check_elems):
+        yield None, (span, ('arity', len(value)))
+    failures = []
+    for i, check_elem in enumerate(check_elems):
+        failed = yield check_elem, value[i]
+        if failed is not None:
+            failures.append((i, failed[1]))
+    yield None, (span, ('tuple', failures, spans)) if failures else None
+
+def is_container(check):
+    return getattr(getattr(check, 'unmemoized', check), 'container', False)
+
+def stacked(check, parts, frames, *args):
+    # check, or an Op doing the same thing if any of its parts are
+    # containers.
+    if any(map(is_container, parts)):
+        op = Op(frames, *args)
+        for name in ('type_names', 'wrap', 'elems', 'strict', 'elems_failure'):
+            if hasattr(check, name):
+                setattr(op, name, getattr(check, name))
+        check = op
+    check.container = True
+    return check
+
+class StackCheckers(Checkers):
+
+    engine = 'stack'
+
+    def nullable_checker(self, check_t):
+        check = nullable_checker(check_t)
+        if not is_container(check_t):
+            return check
+        return stacked(check, [check_t], nullable_frames, check_t)
+
+    def single_checker(self, check_elem, span):
+        check = stacked(single_checker(check_elem, span), [check_elem], single_frames, check_elem, span)
+        return memo_checker(check) if self.memo else check
+
+    def tuple_checker(self, check_elems, spans, span):
+        check = stacked(tuple_checker(check_elems, spans, span), check_elems,
+                        tuple_frames, tuple(check_elems), tuple(spans), span)
+        return memo_checker(check) if self.memo else check
+
+    def list_checker(self, check_elem, span):
+        return stacked(list_checker(check_elem, span, self.containers), [check_elem],
+                       sequence_frames, strict(check_elem), span, self.containers, list, 'list')
+
+    def set_checker(self, check_elem, span):
+        return stacked(set_checker(check_elem, span, self.containers), [check_elem],
+                       sequence_frames, strict(check_elem), span, self.containers, set, 'set')
+
+    def dict_checker(self, check_key, check_val, span, key_span, value_span):
+        return stacked(dict_checker(check_key, check_val, span, key_span, value_span, self.containers), [check_key, check_val],
+                       dict_frames, strict(check_key), strict(check_val), span, key_span, value_span, self.containers)
+
+engines = {'recursive': Checkers, 'stack': StackCheckers}
+
+# the engine used by contracts that weren't given one. The stack engine
+# is slower on the shallow values most contracts see, so it's opt-in.
+checking_engine = {'name': 'recursive'}
+
+def set_engine(name):
+    if name not in engines:
+        raise ValueError('engine is one of %s' % ', '.join(sorted(engines)))
+    checking_engine['name'] = name
+
+def node_key(schema):
+    return (schema.lhs, tuple(child.term or child.lhs for child in schema.rhs))
+
+def rule_key(lhs, *rhs):
+    return (lhs, tuple(r[0] if type(r) == tuple else r for r in rhs))
+
+compilers = {}
+
+def compiles(lhs, *rhs):
+    def register(f):
+        compilers[rule_key(lhs, *rhs)] = f
+        return f
+    return register
+
+def compile_schema(schema, k=checkers):
+    return unwind(compiled, schema, k)
+
+def compiled(schema, k):
+    # the compiler for schema; they're unwind()'s parts, which ask for
+    # the checkers of the schemas they're made of.
+    try:
+        compiler = compilers[node_key(schema)]
+    except KeyError:
+        import pprint
+        raise InternalContractError('compile_schema() is incompletely defined (no case for %s)!' % pprint.PrettyPrinter().pformat(schema))
+    return compiler(schema, k)
+
+@compiles('fun', 'fixed_tup', t_arrow, 'typ')
+def compile_fun(schema, k):
+    yield None, k.fun_checker('%s->%s' % (schema.rhs[0].span, schema.rhs[2].span), canonical(schema))
+
+# these are all just one schema wrapped around another, so they
+# compile down to whatever they wrap.
+@compiles('t', 'fixed_tup')
+@compiles('t', 'list')
+@compiles('t', 'set')
+@compiles('t', 'dict')
+@compiles('t', 'generic')
+@compiles('t', 'fun')
+@compiles('typ', 't')
+def compile_passthrough(schema, k):
+    check = yield compiled, schema.rhs[0]
+    yield None, check
+
+@compiles('t', t_lparen, 'typ', t_rparen)
+def compile_parens(schema, k):
+    check = yield compiled, schema.rhs[1]
+    yield None, check
+
+@compiles('t', t_type)
+def compile_type(schema, k):
+    yield None, k.type_checker(schema.rhs[0].token)
+
+@compiles('typ', 't', t_question)
+def compile_nullable(schema, k):
+    check_t = yield compiled, schema.rhs[0]
+    yield None, k.nullable_checker(check_t)
+
+@compiles('typ', t_caret, t_type)
+def compile_base(schema, k):
+    yield None, k.base_checker(schema.rhs[1].token)
+
+@compiles('list', t_lbrack, 'typ', t_rbrack)
+def compile_list(schema, k):
+    check_elem = yield compiled, schema.rhs[1]
+    yield None, k.list_checker(check_elem, schema.span)
+
+@compiles('set', t_lbrace, 'typ', t_rbrace)
+def compile_set(schema, k):
+    check_elem = yield compiled, schema.rhs[1]
+    yield None, k.set_checker(check_elem, schema.span)
+
+@compiles('dict', 'typ', t_colon, 'typ')
+def compile_dict(schema, k):
+    key, value = schema.rhs[0], schema.rhs[2]
+    check_key = yield compiled, key
+    check_val = yield compiled, value
+    yield None, k.dict_checker(check_key, check_val, schema.span, key.span, value.span)
+
+@compiles('fixed_tup', t_lparen, t_rparen)
+def compile_unit(schema, k):
+    yield None, k.unit_checker(schema.span)
+
+@compiles('fixed_tup', t_lparen, 'typ', t_comma, t_rparen)
+def compile_single(schema, k):
+    check_elem = yield compiled, schema.rhs[1]
+    yield None, k.single_checker(check_elem, schema.span)
+
+def tuple_elements(schema):
+    # more_fixed_tup has the last element on top.
+    more = []
+    p = schema.rhs[4]
+    while True:
+        if rule_matcher(p, 'more_fixed_tup', 'more_fixed_tup', t_comma, 'typ'):
+            more.append(p.rhs[2])
+            p = p.rhs[0]
+        elif rule_matcher(p, 'more_fixed_tup'):
+            break
+        else:
+            raise InternalContractError('the parsetree is fucked right here')
+    return [schema.rhs[1], schema.rhs[3]] + more[::-1]
+
+@compiles('fixed_tup', t_lparen, 'typ', t_comma, 'typ', 'more_fixed_tup', t_rparen)
+def compile_tuple(schema, k):
+    expected = tuple_elements(schema)
+    check_elems = []
+    for e in expected:
+        check_elems.append((yield compiled, e))
+    yield None, k.tuple_checker(check_elems, [e.span for e in expected], schema.span)
+
+def bare_type(schema):
+    # the name in a typ that's nothing but a name, for type parameters.
+    if rule_matcher(schema, 'typ', 't') and rule_matcher(schema.rhs[0], 't', t_type):
+        return schema.rhs[0].rhs[0].token
+    raise InvalidContract('expected a typecode or dtype, but got %s' % schema.span)
+
+@compiles('generic', t_type, t_langle, 'typ', t_rangle)
+@compiles('generic', t_type, t_langle, 'typ', t_comma, t_number, t_rangle)
+def compile_generic(schema, k):
+    name = schema.rhs[0].token
+    ndim = int(schema.rhs[4].token) if len(schema.rhs) == 6 else None
+    if name == 'iter' and ndim is None:
+        check_elem = yield compiled, schema.rhs[2]
+        yield None, k.iter_checker(check_elem, schema.span)
+        return
+    param = bare_type(schema.rhs[2])
+    if name == 'array' and ndim is None:
+        if len(param) != 1:
+            raise InvalidContract('array typecodes are one character, but got %s' % param)
+        yield None, k.array_checker(param, schema.span)
+    elif name == 'ndarray':
+        yield None, k.ndarray_checker(param, ndim, schema.span)
+    else:
+        raise InvalidContract('%s is not a type with parameters' % schema.span)
+
+# parsed and compiled contracts, keyed by their whitespace-stripped
+# text (and options), so that decorating with the same
+# contract twice (e.g. in a closure factory) doesn't go anywhere near
+# the parser.
+contract_cache = LRUCache(1024)
+
+def parse_contract(s, debug=False, k=checkers):
     exprs = earley(s)
     if debug:
         import pprint
@@ -313,33 +1573,633 @@ def contract(s, debug=False, show_line=True):
             print pprint.PrettyPrinter().pformat(e)
         raise AmbiguousContract('contract is not unambiguous!')
     parse = exprs[0]
+    return parse, intern_contract(canonical(parse)), compile_schema(parse.rhs[0], k), compile_schema(parse.rhs[2], k)
+
+# Checking lots of values against a type, rather than calls against a
+# contract: validate('str:(int?)', rows) yields (index, FailedContract)
+# for each row that isn't one.
+
+def value_checker(s, containers=None, engine=None):
+    s = s.translate(None, ' \t\n')
+    k = engines[engine or checking_engine['name']](containers)
+    key = ('validate', s) + k.options()
+    check = contract_cache.get(key)
+    if check is None:
+        exprs = earley(s, 'typ')
+        if len(exprs) == 0:
+            raise InvalidContract('contract could not be parsed!')
+        if len(exprs) > 1:
+            raise AmbiguousContract('contract is not unambiguous!')
+        check = compile_schema(exprs[0], k)
+        if getattr(check, 'wrap', None) is not None:
+            raise InvalidContract("can't validate iter<>, its elements are only checked as they're used")
+        contract_cache.put(key, check)
+    return check
+
+def validate_chunk(s, containers, engine, start, values):
+    check = value_checker(s, containers, engine)
+    failures = []
+    for i, value in enumerate(values, start):
+        try:
+            check(value)
+        except InternalFailedContract, e:
+            failures.append((i, FailedContract(e.args[0], e.args[1], 'value', None)))
+    return failures
+
+def validate(s, values, chunk_size=1000, processes=None, containers=None, engine=None):
+    """Checks each of values against the type s, yielding (index,
+    FailedContract) for each one that fails. values are taken a chunk
+    at a time, so they can be a stream too big to fit in memory; give
+    processes to check chunks in that many processes at once (in which
+    case the values have to be picklable)."""
+    # (parsed here, so a bad contract is complained about straight away
+    # rather than on the first next().)
+    engine = engine or checking_engine['name']
+    value_checker(s, containers, engine)
+    return validated(s, iter(values), chunk_size, processes, containers, engine)
+
+def validated(s, values, chunk_size, processes, containers, engine):
+    chunks = ((start, list(itertools.islice(values, chunk_size))) for start in itertools.count(0, chunk_size))
+    chunks = itertools.takewhile(lambda chunk: chunk[1], chunks)
+    if processes is None:
+        for start, chunk in chunks:
+            for failure in validate_chunk(s, containers, engine, start, chunk):
+                yield failure
+        return
+    import multiprocessing
+    pool = multiprocessing.Pool(processes)
+    try:
+        # only a couple of chunks per process in flight at once, so
+        # the values aren't all read in ahead of the workers.
+        in_flight = collections.deque()
+        for start, chunk in chunks:
+            in_flight.append(pool.apply_async(validate_chunk, (s, containers, engine, start, chunk)))
+            if len(in_flight) >= 2 * processes:
+                for failure in in_flight.popleft().get():
+                    yield failure
+        while in_flight:
+            for failure in in_flight.popleft().get():
+                yield failure
+    finally:
+        pool.terminate()
+        pool.join()
+
+# Checkers built ahead of time by precompile.py, keyed by contract
+# text. A precompiled module registers its builders when it's
+# imported; they're thrown away if they were generated for a different
+# grammar or compiler than this one.
+precompiled = {}
+
+compiler_version = '2-' + hashlib.sha1(repr(rules)).hexdigest()[:12]
+
+def register_precompiled(s, version, canonical, build):
+    if version != compiler_version:
+        warnings.warn('ignoring precompiled contract %r, it was generated by a different version of contract.py' % s)
+        return False
+    precompiled[s] = (canonical, build)
+    return True
+
+class Sampler(object):
+    """Decides which calls get their contract checked: every nth call,
+    each call with some probability, or up to some number of calls a
+    second. Keeps count of how many calls were checked and skipped."""
+
+    def __init__(self, every=None, probability=None, per_second=None):
+        if [every, probability, per_second].count(None) != 2:
+            raise ValueError('give exactly one of every, probability or per_second')
+        if every is not None and every < 1:
+            raise ValueError('every must be at least 1')
+        if probability is not None and not 0 <= probability <= 1:
+            raise ValueError('probability must be between 0 and 1')
+        if per_second is not None and per_second < 0:
+            raise ValueError('per_second must be at least 0')
+        self.every = every
+        self.probability = probability
+        self.per_second = per_second
+        self.lock = threading.Lock()
+        self.calls = self.checked = 0
+        self.second = None
+        self.checked_this_second = 0
+
+    def __call__(self):
+        with self.lock:
+            self.calls += 1
+            if self.every is not None:
+                check = (self.calls - 1) % self.every == 0
+            elif self.probability is not None:
+                check = random.random() < self.probability
+            else:
+                second = int(time.time())
+                if second != self.second:
+                    self.second = second
+                    self.checked_this_second = 0
+                check = self.checked_this_second < self.per_second
+                self.checked_this_second += check
+            self.checked += check
+            return check
+
+    def info(self):
+        with self.lock:
+            return {'checked': self.checked, 'skipped': self.calls - self.checked}
+
+# the samplers used by contracts that weren't given their own; None
+# means every call is checked.
+sampling = {'input': None, 'output': None}
+
+def set_sampling(input=None, output=None):
+    sampling['input'] = input
+    sampling['output'] = output
+
+class Deferred(object):
+    """Checks outputs in the background, on a few worker threads, so
+    the function can return straight away. Failures are handed to
+    on_failure: 'log' logs them, 'count' just counts them, 'raise'
+    raises each one from the next call (through a contract deferring to
+    this) to check its output, or give a function to call with the
+    FailedContract. When the queue is full, outputs are either not
+    checked ('drop') or checked there and then ('inline'). Give
+    snapshot=True to check a deep copy of each output, in case it's
+    changed before the check gets to it."""
+
+    def __init__(self, workers=1, queue_size=1000, on_failure='log', when_full='drop', snapshot=False):
+        if when_full not in ('drop', 'inline'):
+            raise ValueError("when_full is 'drop' or 'inline'")
+        if on_failure not in ('log', 'count', 'raise') and not callable(on_failure):
+            raise ValueError("on_failure is 'log', 'count', 'raise' or a function")
+        self.workers = workers
+        self.queue = Queue.Queue(queue_size)
+        self.on_failure = on_failure
+        self.when_full = when_full
+        self.snapshot = snapshot
+        self.lock = threading.Lock()
+        self.threads = []
+        self.pending = collections.deque()
+        self.counts = {'checked': 0, 'failed': 0, 'dropped': 0, 'inline': 0}
+
+    def deferring(self, check, failure):
+        # a checker which queues values up for check, and makes any
+        # failure into a FailedContract with failure().
+        if not self.threads:
+            self.start()
+        def check_later(value):
+            # an earlier failure's taken before this value's queued (so
+            # it can't be this value's own) and raised after (so this
+            # value still gets checked).
+            earlier = None
+            if self.pending:
+                try:
+                    earlier = self.pending.popleft()
+                except IndexError:
+                    pass
+            try:
+                self.put(check, value, failure)
+            except InternalFailedContract:
+                if earlier is not None:
+                    self.pending.appendleft(earlier)
+                raise
+            if earlier is not None:
+                raise earlier
+        return check_later
+
+    def put(self, check, value, failure):
+        if self.snapshot:
+            try:
+                value = copy.deepcopy(value)
+            except (TypeError, copy.Error):
+                # it can't be copied (a generator, a lock, a file..), so
+                # check it now, while it's still the same.
+                self.count('inline')
+                check(value)
+                return
+        try:
+            self.queue.put_nowait((check, value, failure))
+        except Queue.Full:
+            self.count('inline' if self.when_full == 'inline' else 'dropped')
+            if self.when_full == 'inline':
+                check(value)
+
+    def start(self):
+        with self.lock:
+            while len(self.threads) < self.workers:
+                thread = threading.Thread(target=self.work, name='contract checker')
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def work(self):
+        while True:
+            check, value, failure = self.queue.get()
+            try:
+                check(value)
+                self.count('checked')
+            except InternalFailedContract, e:
+                self.count('checked')
+                self.count('failed')
+                self.failed(failure(e))
+            except Exception:
+                logging.getLogger('contract').exception('error checking a deferred output')
+            finally:
+                self.queue.task_done()
+
+    def failed(self, e):
+        if self.on_failure == 'log':
+            logging.getLogger('contract').error('%s', e)
+        elif self.on_failure == 'raise':
+            self.pending.append(e)
+        elif self.on_failure != 'count':
+            self.on_failure(e)
+
+    def count(self, what):
+        with self.lock:
+            self.counts[what] += 1
+
+    def wait(self):
+        """Waits for everything queued so far to be checked."""
+        self.queue.join()
+
+    def info(self):
+        with self.lock:
+            return dict(self.counts, queued=self.queue.qsize())
+
+class Registration(object):
+    """A function wrapped by contract(), and whether its contract is
+    currently being enforced."""
+
+    def __init__(self, name, contract, where, enabled):
+        self.name = name
+        self.contract = contract
+        self.where = where
+        self.enabled = enabled
+        self.stats = None
+
+    def __repr__(self):
+        return '<Registration %s %s %s>' % (self.name, self.contract, 'on' if self.enabled else 'off')
+
+# Every function wrapped by contract(), held weakly so that wrappers
+# made on the fly don't live forever. Whether a function's contract is
+# enforced is decided by the last of the rules whose pattern matches its
+# module.name, or by the default if none do.
+registry = weakref.WeakSet()
+registry_lock = threading.Lock()
+enforcement = {'default': True, 'rules': []}
+
+def enforced(name):
+    enabled = enforcement['default']
+    for pattern, on in enforcement['rules']:
+        if fnmatch.fnmatchcase(name, pattern):
+            enabled = on
+    return enabled
+
+def enforce(enabled=True, pattern=None):
+    """Turns contract enforcement on or off: everywhere if there's no
+    pattern, or else for the functions whose module.name matches it.
+    Applies to functions already wrapped as well as those wrapped
+    later."""
+    with registry_lock:
+        if pattern is None:
+            enforcement['default'] = enabled
+            enforcement['rules'] = []
+        else:
+            enforcement['rules'] = [r for r in enforcement['rules'] if r[0] != pattern] + [(pattern, enabled)]
+        for registration in registry:
+            registration.enabled = enforced(registration.name)
+
+def registered():
+    with registry_lock:
+        return sorted(registry, key=lambda r: (r.name, r.where))
+
+def enforce_from_environment(setting):
+    # e.g. CONTRACT_ENFORCE="off,myapp.payments.*=on": comma separated,
+    # each one on or off, for everything or for a pattern.
+    for part in filter(None, setting.translate(None, ' \t\n').split(',')):
+        pattern, _, value = part.rpartition('=')
+        if value.lower() not in ('on', 'off'):
+            raise ValueError('bad CONTRACT_ENFORCE setting %r, expected on or off' % part)
+        enforce(value.lower() == 'on', pattern or None)
+
+enforce_from_environment(os.environ.get('CONTRACT_ENFORCE', ''))
+
+# Call counts, failure counts and how long calls spend checking input,
+# in the function itself and checking output, per contract and call
+# site. Off unless switched on, since timing every call costs.
+instrumentation = {'on': False, 'hook': None}
+timer = time.time
+
+class Histogram(object):
+    """Counts durations into buckets by powers of two, from a
+    microsecond up to 2**20 of them (about a second), then everything
+    over that."""
+
+    bounds = [2 ** i / 1e6 for i in range(21)]
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(self.bounds) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(self.bounds, seconds)] += 1
+
+    def snapshot(self):
+        return {'count': self.count, 'total': self.total, 'max': self.max,
+                'buckets': zip(self.bounds + [float('inf')], self.buckets)}
+
+class CallStats(object):
+
+    def __init__(self, contract, where):
+        self.contract = contract
+        self.where = where
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.failures = {'input': 0, 'output': 0}
+        self.times = {'input': Histogram(), 'call': Histogram(), 'output': Histogram()}
+
+    def record(self, input, call, output, failed):
+        with self.lock:
+            self.calls += 1
+            if failed is not None:
+                self.failures[failed] += 1
+            for which, seconds in (('input', input), ('call', call), ('output', output)):
+                if seconds is not None:
+                    self.times[which].add(seconds)
+        hook = instrumentation['hook']
+        if hook is not None:
+            # a broken hook shouldn't break the call it's hearing about.
+            try:
+                hook(self.contract, self.where, {'input': input, 'call': call, 'output': output, 'failed': failed})
+            except Exception:
+                logging.getLogger('contract').exception('error in the instrumentation hook')
+
+    def snapshot(self):
+        with self.lock:
+            return {'calls': self.calls, 'failures': dict(self.failures),
+                    'times': dict((which, h.snapshot()) for which, h in self.times.items())}
+
+# CallStats by (contract, where), shared by wrappers made at the same
+# call site.
+all_call_stats = {}
+call_stats_lock = threading.Lock()
+
+def call_stats(contract, where):
+    key = (str(contract), where)
+    with call_stats_lock:
+        if key not in all_call_stats:
+            all_call_stats[key] = CallStats(key[0], where)
+        return all_call_stats[key]
+
+def set_instrumentation(on=True, hook=None):
+    """Switches instrumentation on or off. hook, if given, is called
+    after every instrumented call with the contract, where, and a dict
+    of the input, call and output times (None if it didn't get that
+    far) and which check failed, if any."""
+    instrumentation['hook'] = hook
+    instrumentation['on'] = on
+
+def instrumentation_snapshot():
+    with call_stats_lock:
+        stats = all_call_stats.items()
+    return dict((key, s.snapshot()) for key, s in stats)
+
+def reset_instrumentation():
+    with call_stats_lock:
+        all_call_stats.clear()
+    with registry_lock:
+        for registration in registry:
+            registration.stats = None
+
+# When a function's parameters line up one to one with its contract's
+# input tuple, contract() writes it a wrapper with the same signature,
+# which checks each argument directly (so it can be called with keyword
+# arguments, and defaults are filled in and checked) instead of packing
+# them into a tuple. Calls with the wrong arguments fail with the same
+# TypeError the function itself would give. The generated wrapper's own
+# names all start with __, so the function's parameters can't shadow
+# them.
+
+CO_VARARGS = 0x04
+CO_VARKEYWORDS = 0x08
+
+specialized_template = '''
+def make(%(closure)s):
+    def inner(%(params)s):
+        if not __registration.enabled:
+            return __f(%(args)s)
+        if __instrumentation['on']:
+            return __instrumented(%(packed)s)
+        __sample = __sample_input or __sampling['input']
+        if __sample is None or __sample():
+            __failures = None
+%(checks)s
+            if __failures is not None:
+                __fail_input(__elems_failure(__failures))
+        __output = __f(%(args)s)
+        __sample = __sample_output or __sampling['output']
+        if __sample is None or __sample():
+            try:
+                %(check_output)s
+            except __InternalFailedContract, __e:
+                __fail_output(__e)
+            if __wrap_output is not None:
+                __output = __wrap_output(__output, __fail_output)
+        return __output
+    return inner
+'''
+
+# each argument's check, which adds to __failures (the way the checker
+# for the whole tuple would) rather than stopping at the first one.
+specialized_check = '''            try:
+                %s
+            except __InternalFailedContract, __e:
+                __failures = (__failures or []) + [(%i, __e.args[1])]'''
+
+# the compiled make()s, by the shape of the wrapper they make: its
+# parameter names, how many have defaults, and which checks are inlined.
+# Decorating another function of the same shape just calls make() with
+# its own checkers, so there's no compiling to do.
+wrapper_factories = LRUCache(256)
+
+def specializable(f, check_input):
+    code = f.func_code
+    names = code.co_varnames[:code.co_argcount]
+    elems = getattr(check_input, 'elems', None)
+    return (elems is not None and len(elems) == len(names)
+            and getattr(check_input, 'wrap', None) is None
+            and hasattr(check_input, 'elems_failure')
+            and not code.co_flags & (CO_VARARGS | CO_VARKEYWORDS)
+            and all(re.match(r'[A-Za-z_][A-Za-z0-9_]*$', n) and not n.startswith('__') for n in names))
+
+def inline_check(name, checker, check, namespace):
+    # checkers which only look at the name of the type can be skipped
+    # when it's one they accept; they'll be called to fail otherwise.
+    type_names = getattr(check, 'type_names', None)
+    if type_names is None:
+        return '%s(%s)' % (checker, name)
+    namespace[checker + '_names'] = type_names
+    return 'if __type(%s).__name__ not in %s_names: %s(%s)' % (name, checker, checker, name)
+
+def specialized_inner(f, check_input, namespace):
+    code = f.func_code
+    names = code.co_varnames[:code.co_argcount]
+    defaults = f.func_defaults or ()
+    namespace = dict(namespace, __defaults=defaults, __type=type, __InternalFailedContract=InternalFailedContract,
+                     __elems_failure=check_input.elems_failure)
+    checks = []
+    for i, (name, check) in enumerate(zip(names, check_input.elems)):
+        namespace['__check_%i' % i] = check
+        checks.append(specialized_check % (inline_check(name, '__check_%i' % i, check, namespace), i))
+    check_output = inline_check('__output', '__check_output', namespace['__check_output'], namespace)
+    # which checks got inlined is in the namespace, as their _names.
+    shape = (names, len(defaults), tuple(sorted(namespace)))
+    make = wrapper_factories.get(shape)
+    if make is None:
+        required = names[:len(names) - len(defaults)]
+        params = list(required) + ['%s=__defaults[%i]' % (name, i) for i, name in enumerate(names[len(required):])]
+        source = specialized_template % {
+            'closure': ', '.join(sorted(namespace)),
+            'params': ', '.join(params),
+            'args': ', '.join(names),
+            'packed': '(%s)' % ''.join(name + ', ' for name in names),
+            'checks': '\n'.join(checks),
+            'check_output': check_output,
+            }
+        scope = {}
+        exec compile(source, '<contract wrapper>', 'exec') in scope
+        make = scope['make']
+        wrapper_factories.put(shape, make)
+    return make(**namespace)
+
+def contract(s, debug=False, show_line=True, sample_input=None, sample_output=None, containers=None, memo=False, defer_output=None, engine=None, autowrap=False):
+    # if nothing's being enforced, don't even parse it.
+    if not enforcement['default'] and not any(on for _, on in enforcement['rules']):
+        return lambda f: f
+    # parse it, unless we already have.
+    s = s.translate(None, ' \t\n')
+    k = engines[engine or checking_engine['name']](containers, memo, autowrap, show_line)
+    key = (s,) + k.options()
+    compiled = contract_cache.get(key)
+    if compiled is None and s in precompiled and not debug:
+        canonical_form, build = precompiled[s]
+        compiled = (None, intern_contract(canonical_form)) + build(k)
+        contract_cache.put(key, compiled)
+    elif compiled is None or (debug and compiled[0] is None):
+        compiled = parse_contract(s, debug, k)
+        contract_cache.put(key, compiled)
+    elif debug:
+        import pprint
+        pprint.PrettyPrinter().pprint([compiled[0]])
+    parse, interned, check_input, check_output = compiled
+    check_input = getattr(check_input, 'unmemoized', check_input)
+    wrap_input = getattr(check_input, 'wrap', None)
+    wrap_output = getattr(check_output, 'wrap', None)
     # here's the wrapper that enforces the contract.
     def wrapped(f):
+        name = '%s.%s' % (f.__module__, f.__name__)
+        # (even if name's contract is off, it gets a wrapper, to switch
+        # on later and to have a __contract__ for fun contracts to see.)
         where = '%s L%i' % (f.func_code.co_filename, f.func_code.co_firstlineno)
-        def inner(*args):
-            # check the input..
+        registration = Registration(name, interned, where, True)
+        def failure(which, e):
+            return FailedContract(e.args[0], e.args[1], which, where if show_line else None)
+        def failed(which, e):
+            raise failure(which, e)
+        fail_input = lambda e: failed('input', e)
+        fail_output = lambda e: failed('output', e)
+        if defer_output is None:
+            output_checker = check_output
+        else:
+            output_checker = defer_output.deferring(check_output, lambda e: failure('output', e))
+        def checked_input(args):
+            sample = sample_input or sampling['input']
+            if sample is None or sample():
+                try:
+                    check_input(args)
+                except InternalFailedContract, e:
+                    fail_input(e)
+                if wrap_input is not None:
+                    args = wrap_input(args, fail_input)
+            return args
+        def checked_output(output):
+            sample = sample_output or sampling['output']
+            if sample is None or sample():
+                try:
+                    output_checker(output)
+                except InternalFailedContract, e:
+                    fail_output(e)
+                if wrap_output is not None:
+                    output = wrap_output(output, fail_output)
+            return output
+        def instrumented(args):
+            stats = registration.stats
+            if stats is None:
+                stats = registration.stats = call_stats(interned, where)
+            t0 = timer()
             try:
-                check_value(parse['rhs'][0], args)
-            except InternalFailedContract, e:
-                if show_line:
-                    raise FailedContract('%s: expected input is %s, but got %s' % (where, e.args[0], e.args[1]))
-                else:
-                    raise FailedContract('expected input is %s, but got %s' % (e.args[0], e.args[1]))
+                args = checked_input(args)
+            except FailedContract:
+                stats.record(timer() - t0, None, None, 'input')
+                raise
+            t1 = timer()
+            t2 = None
+            try:
+                output = f(*args)
+                t2 = timer()
+            finally:
+                if t2 is None:
+                    # f raised, which still counts as a call.
+                    stats.record(t1 - t0, timer() - t1, None, None)
+            try:
+                output = checked_output(output)
+            except FailedContract:
+                stats.record(t1 - t0, t2 - t1, timer() - t2, 'output')
+                raise
+            stats.record(t1 - t0, t2 - t1, timer() - t2, None)
+            return output
+        def inner(*args):
+            if not registration.enabled:
+                return f(*args)
+            if instrumentation['on']:
+                return instrumented(args)
+            # check the input.. (checked_input and checked_output,
+            # inlined, for speed.)
+            sample = sample_input or sampling['input']
+            if sample is None or sample():
+                try:
+                    check_input(args)
+                except InternalFailedContract, e:
+                    fail_input(e)
+                if wrap_input is not None:
+                    args = wrap_input(args, fail_input)
             # Now check the output. We do input and output checking
             # separately, because we don't want to run the inner
             # method with input which we know is wrong.
             output = f(*args)
-            try:
-                check_value(parse['rhs'][2], output)
-            except InternalFailedContract, e:
-                if show_line:
-                    raise FailedContract('%s: expected output is %s, but got %s' % (where, e.args[0], e.args[1]))
-                else:
-                    raise FailedContract('expected output is %s, but got %s' % (e.args[0], e.args[1]))
+            sample = sample_output or sampling['output']
+            if sample is None or sample():
+                try:
+                    output_checker(output)
+                except InternalFailedContract, e:
+                    fail_output(e)
+                if wrap_output is not None:
+                    output = wrap_output(output, fail_output)
             # if it got this far, we're good.
             return output
-        # this is horrible, there needs to be some enforcement of a canonical form for this to really work
-        inner.__contract__ = s
+        if specializable(f, check_input):
+            inner = specialized_inner(f, check_input, {
+                '__f': f, '__registration': registration,
+                '__instrumentation': instrumentation, '__instrumented': instrumented,
+                '__sampling': sampling, '__sample_input': sample_input, '__sample_output': sample_output,
+                '__check_input': check_input, '__fail_input': fail_input,
+                '__check_output': output_checker, '__wrap_output': wrap_output, '__fail_output': fail_output,
+                })
+        inner.__name__, inner.__doc__, inner.__module__ = f.__name__, f.__doc__, f.__module__
+        inner.__contract__ = interned
+        inner.__registration__ = registration
+        with registry_lock:
+            registration.enabled = enforced(name)
+            registry.add(registration)
         return inner
     return wrapped
-
@@ -0,0 +1,155 @@
+"""Build the checkers for a codebase's contracts ahead of time.
+
+    python precompile.py -o myapp/_contracts.py myapp/
+    python precompile.py --check -o myapp/_contracts.py myapp/
+
+The first finds every contract('...') in the given files (or the .py
+files under the given directories) and writes a module which builds
+their checkers without going near the parser. Import that module
+before the modules that use @contract; any contract it doesn't know
+about is still parsed at runtime, as usual.
+
+The second exits non-zero if the generated module is out of date:
+contracts were added or changed since it was generated, or it was
+generated by a different version of contract.py.
+"""
+
+import argparse
+import ast
+import os
+import sys
+
+import contract
+
+class Source(str):
+    pass
+
+def to_source(arg):
+    if isinstance(arg, Source):
+        return arg
+    if type(arg) == list:
+        return Source('[%s]' % ', '.join(map(to_source, arg)))
+    return Source(repr(arg))
+
+class SourceCheckers(object):
+    # stands in for the checker constructors when compiling a schema,
+    # writing out the call instead of making it.
+    def __getattr__(self, name):
+        def emit(*args):
+            return Source('k.%s(%s)' % (name, ', '.join(map(to_source, args))))
+        return emit
+
+def python_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    if filename.endswith('.py'):
+                        yield os.path.join(dirpath, filename)
+        else:
+            yield path
+
+def find_contracts(paths):
+    found = []
+    for path in python_files(paths):
+        with open(path) as f:
+            tree = ast.parse(f.read(), path)
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.Call) or not node.args or not isinstance(node.args[0], ast.Str):
+                continue
+            if getattr(node.func, 'id', getattr(node.func, 'attr', None)) != 'contract':
+                continue
+            s = node.args[0].s.translate(None, ' \t\n')
+            if s not in found:
+                found.append(s)
+    return found
+
+def compile_source(s):
+    # s's canonical form and the source for building its input and
+    # output checkers, or None if there's something wrong with s (it'll
+    # be reported at runtime).
+    exprs = contract.earley(s)
+    if len(exprs) != 1:
+        sys.stderr.write('skipping %r, it is %s\n' % (s, 'ambiguous' if exprs else 'not a valid contract'))
+        return None
+    k = SourceCheckers()
+    try:
+        return (contract.canonical(exprs[0]),
+                contract.compile_schema(exprs[0].rhs[0], k),
+                contract.compile_schema(exprs[0].rhs[2], k))
+    except contract.InvalidContract, e:
+        sys.stderr.write('skipping %r, %s\n' % (s, e.message))
+        return None
+
+def generate(contracts, contract_module='contract'):
+    lines = [
+        '# Generated by precompile.py, regenerate it rather than editing it.',
+        'from %s import register_precompiled' % contract_module,
+        '',
+        'VERSION = %r' % contract.compiler_version,
+        'CONTRACTS = [',
+        ]
+    builds = []
+    contracts = [s.translate(None, ' \t\n') for s in contracts]
+    compiled = [(s, compile_source(s)) for s in contracts]
+    for i, (s, (canonical, check_input, check_output)) in enumerate([(s, c) for s, c in compiled if c is not None]):
+        lines.append('    %r,' % s)
+        builds.extend([
+            '',
+            'def build_%i(k):' % i,
+            '    return (%s,' % check_input,
+            '            %s)' % check_output,
+            'register_precompiled(%r, VERSION, %r, build_%i)' % (s, canonical, i),
+            ])
+    lines.append('    ]')
+    return '\n'.join(lines + builds) + '\n'
+
+def read_generated(path):
+    # (VERSION, CONTRACTS) of a generated module, without importing it.
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    found = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1:
+            name = getattr(node.targets[0], 'id', None)
+            if name in ('VERSION', 'CONTRACTS'):
+                found[name] = ast.literal_eval(node.value)
+    return found.get('VERSION'), found.get('CONTRACTS', [])
+
+def staleness(path, contracts):
+    """Returns a list of reasons the module generated at path doesn't
+    match contracts, which is empty if it's up to date."""
+    if not os.path.exists(path):
+        return ['%s does not exist' % path]
+    version, generated = read_generated(path)
+    reasons = []
+    if version != contract.compiler_version:
+        reasons.append('generated by contract.py version %s, this is %s' % (version, contract.compiler_version))
+    for s in contracts:
+        if s not in generated and compile_source(s) is not None:
+            reasons.append('missing %r' % s)
+    for s in generated:
+        if s not in contracts:
+            reasons.append('no longer used %r' % s)
+    return reasons
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build the checkers for contracts ahead of time.')
+    parser.add_argument('paths', nargs='+', help='python files, or directories to search for them')
+    parser.add_argument('-o', '--output', required=True, help='the module to generate')
+    parser.add_argument('--check', action='store_true', help="don't generate, exit 1 if the output is out of date")
+    parser.add_argument('--contract-module', default='contract', help='where to import contract.py from in the output')
+    args = parser.parse_args(argv)
+    contracts = find_contracts(args.paths)
+    if args.check:
+        reasons = staleness(args.output, contracts)
+        for reason in reasons:
+            print '%s: %s' % (args.output, reason)
+        return 1 if reasons else 0
+    with open(args.output, 'w') as f:
+        f.write(generate(contracts, args.contract_module))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,26 @@
-from contract import contract, InvalidContract, FailedContract, red
+from contract import contract, InvalidContract, AmbiguousContract, FailedContract, red
+from contract import earley, check_value, compile_schema, InternalFailedContract
+from contract import Sampler, set_sampling, ContainerPolicy, set_container_policy
+from contract import enforce, registered, Deferred, validate, set_engine
+from contract import set_instrumentation, instrumentation_snapshot, reset_instrumentation
+import contract as contract_module
+import bench
+import precompile
+import array
 import functools
+import gc
+import inspect
+import itertools
+import logging
+import os
+import pickle
+import random
+import sys
+import tempfile
+import threading
 import unittest
+import warnings
+import weakref
 
 contract = functools.partial(contract, show_line=False)
 red = functools.partial(red, try_termcolor=False)
@@ -46,7 +66,7 @@ class TestContracts(BetterTestCase):
         # this is ok
         self.assertEqual(i_give_you_happy(joy_joy), 'happy happy joy joy')
         # these are not ok
-        self.assertRaisesString(FailedContract, 'expected input is ((str,)->str,), but got (_,)', i_give_you_happy)
+        self.assertRaises(TypeError, i_give_you_happy)
         self.assertRaisesString(FailedContract, 'expected input is ((str,)->str,), but got (%s,)' % red(red('str')), i_give_you_happy, 'joy joy')
         # I opine that this contract was never valid in the first
         # place. This is the only case that this exception should ever
@@ -199,5 +219,1171 @@ class TestContracts(BetterTestCase):
         #self.assertRaisesString(FailedContract, 'expected input is ([int],[[str]]), but got ([..%s..],[..%s..],)' % (red('str'), red('[..int..]')),
         #                        f, [5, 'hehe'], [['derp', 'durp'], [4, 'lawl']])                      
 
+class TestHomogeneousContainers(BetterTestCase):
+
+    def test_nullable_elements(self):
+        @contract('([int?], {str?}) -> int')
+        def f(l, s):
+            return 0
+        self.assertEqual(f([1, None, 2], set(['a', None])), 0)
+        self.assertRaisesString(FailedContract, 'expected input is ([int?],{str?}), but got ([..>>>>str<<<<..],{str?},)', f, [1, None, 'hi'], set())
+        self.assertRaisesString(FailedContract, 'expected input is ([int?],{str?}), but got ([int?],{..>>>>int<<<<..},)', f, [], set([None, 5]))
+
+    def test_dict(self):
+        @contract('(str:float,) -> int')
+        def f(d):
+            return 0
+        self.assertEqual(f(dict((str(i), float(i)) for i in range(100))), 0)
+        self.assertRaisesString(FailedContract, 'expected input is (str:float,), but got (%s,)' % red('{..str:%s..}' % red(red('int'))), f, {'a': 1.0, 'b': 2})
+
+    def test_array(self):
+        @contract('(array<d>,) -> array<l>')
+        def f(a):
+            return array.array('l', [int(x) for x in a])
+        self.assertEqual(f(array.array('d', [1.0, 2.0])).tolist(), [1, 2])
+        self.assertRaisesString(FailedContract, 'expected input is (array<d>,), but got (%s,)' % red(red('array<l>')), f, array.array('l', [1]))
+        self.assertRaisesString(FailedContract, 'expected input is (array<d>,), but got (%s,)' % red(red('list')), f, [1.0])
+
+    def test_ndarray(self):
+        # anything called ndarray will do, like everywhere else.
+        class dtype(object):
+            def __init__(self, name):
+                self.name = name
+        class ndarray(object):
+            def __init__(self, dtype_name, ndim):
+                self.dtype = dtype(dtype_name)
+                self.ndim = ndim
+        @contract('(ndarray<float64,2>, ndarray<int32>) -> int')
+        def f(matrix, v):
+            return 0
+        self.assertEqual(f(ndarray('float64', 2), ndarray('int32', 3)), 0)
+        self.assertRaisesString(FailedContract, 'expected input is (ndarray<float64,2>,ndarray<int32>), but got (>>ndarray<float64,1><<,ndarray<int32>,)',
+                                f, ndarray('float64', 1), ndarray('int32', 1))
+        self.assertRaisesString(FailedContract, 'expected input is (ndarray<float64,2>,ndarray<int32>), but got (ndarray<float64,2>,>>ndarray<int64,1><<,)',
+                                f, ndarray('float64', 2), ndarray('int64', 1))
+
+    def test_invalid_parameters(self):
+        for s in ['(array<dd>,) -> int', '(array<[d]>,) -> int', '(array<d,1>,) -> int', '(list<int>,) -> int']:
+            with self.assertRaises(InvalidContract):
+                contract(s)
+
+    def test_type_names(self):
+        class HTTP2_client(object):
+            pass
+        @contract('(HTTP2_client,) -> int')
+        def f(c):
+            return 0
+        self.assertEqual(f(HTTP2_client()), 0)
+
+class TestIterators(BetterTestCase):
+
+    def test_output(self):
+        @contract('(int,) -> iter<int>')
+        def count_to(n):
+            for i in range(n):
+                yield i
+            yield 'done'
+        numbers = count_to(3)
+        self.assertEqual([next(numbers) for _ in range(3)], [0, 1, 2])
+        self.assertRaisesString(FailedContract, 'expected output is iter<int>, but got iter<..3:%s..>' % red(red('str')), next, numbers)
+        self.assertRaisesString(FailedContract, 'expected output is iter<int>, but got %s' % red('int'), contract('(int,) -> iter<int>')(lambda n: n), 5)
+
+    def test_input(self):
+        @contract('(str, iter<int?>) -> int')
+        def total(name, numbers):
+            return sum(n or 0 for n in numbers)
+        self.assertEqual(total('a', iter([1, None, 2])), 3)
+        self.assertEqual(total('a', [1, 2]), 3)
+        self.assertRaisesString(FailedContract, 'expected input is iter<int?>, but got iter<..1:%s..>' % red(red('str')), total, 'a', iter([1, 'hi']))
+        self.assertRaisesString(FailedContract, 'expected input is (str,iter<int?>), but got (str,>>int<<,)', total, 'a', 5)
+
+    def test_generators(self):
+        @contract('() -> iter<int>')
+        def running_total():
+            total = 0
+            while True:
+                try:
+                    n = yield total
+                except ValueError:
+                    n = 'reset'
+                total = 0 if n == 'reset' else total + n
+        totals = running_total()
+        self.assertEqual(next(totals), 0)
+        self.assertEqual(totals.send(2), 2)
+        self.assertEqual(totals.send(3), 5)
+        self.assertEqual(totals.throw(ValueError), 0)
+        totals.close()
+        self.assertRaises(StopIteration, totals.send, 1)
+        # what comes back from send() is checked too.
+        @contract('() -> iter<int>')
+        def echo():
+            value = 0
+            while True:
+                value = yield value
+        echoes = echo()
+        next(echoes)
+        self.assertEqual(echoes.send(1), 1)
+        self.assertRaisesString(FailedContract, 'expected output is iter<int>, but got iter<..2:%s..>' % red(red('str')), echoes.send, 'hi')
+        # iterators which aren't generators don't grow a send().
+        @contract('() -> iter<int>')
+        def numbers():
+            return iter([1, 2])
+        self.assertFalse(hasattr(numbers(), 'send'))
+
+    def test_iterables_can_be_iterated_again(self):
+        @contract('(iter<int>,) -> int')
+        def twice(xs):
+            return sum(xs) + sum(x for x in xs) + len(xs)
+        self.assertEqual(twice([1, 2, 3]), 15)
+        self.assertEqual(twice((1, 2, 3)), 15)
+        self.assertRaisesString(FailedContract, 'expected input is iter<int>, but got iter<..1:%s..>' % red(red('str')), twice, [1, 'a'])
+        # iterators still can't be.
+        @contract('(iter<int>,) -> int')
+        def total(xs):
+            return sum(xs) + sum(xs)
+        self.assertEqual(total(iter([1, 2, 3])), 6)
+
+    def test_unbounded(self):
+        @contract('() -> iter<int>')
+        def forever():
+            return itertools.count()
+        self.assertEqual(list(itertools.islice(forever(), 1000, 1003)), [1000, 1001, 1002])
+
+    def test_nested(self):
+        @contract('(iter<iter<int>>,) -> [int]')
+        def flatten(iterators):
+            return [i for iterator in iterators for i in iterator]
+        self.assertEqual(flatten([[1], [2, 3]]), [1, 2, 3])
+        self.assertRaisesString(FailedContract, 'expected input is iter<int>, but got iter<..0:%s..>' % red(red('str')), flatten, [[1], ['hi']])
+
+    def test_not_in_containers(self):
+        for s in ['([iter<int>],) -> int', '(str:iter<int>,) -> int']:
+            with self.assertRaises(InvalidContract):
+                contract(s)
+
+class TestMemo(BetterTestCase):
+
+    def setUp(self):
+        contract_module.memo_cache.clear()
+
+    def test_immutable_values_are_remembered(self):
+        @contract('((str, (int, float?), str), int) -> int', memo=True)
+        def f(config, i):
+            return i
+        config = ('a', (1, None), 'b')
+        self.assertEqual(f(config, 1), 1)
+        self.assertEqual(f(config, 2), 2)
+        info = contract_module.memo_cache.info()
+        # the outer tuple is remembered, so the inner one isn't asked about again.
+        self.assertEqual((info['hits'], info['size']), (1, 2))
+        # an equal but different tuple is a different value.
+        self.assertEqual(f(('a', (1, None), 'b'), 3), 3)
+        self.assertEqual(contract_module.memo_cache.info()['hits'], 1)
+        self.assertRaisesString(FailedContract, 'expected input is ((str,(int,float?),str),int), but got ((str,str,str,),int,)', f, ('a', 'b', 'c'), 4)
+
+    def test_none_is_checked(self):
+        @contract('((int, int),) -> int', memo=True)
+        def f(pair):
+            return 1
+        self.assertRaises(FailedContract, f, None)
+        @contract('([(int, str)],) -> int', memo=True)
+        def g(pairs):
+            return 1
+        self.assertRaises(FailedContract, g, [None, None])
+
+    def test_mutable_values_are_not(self):
+        @contract('((str, [int]),) -> int', memo=True)
+        def f(pair):
+            return 0
+        pair = ('a', [1])
+        f(pair)
+        pair[1].append('hi')
+        self.assertRaises(FailedContract, f, pair)
+        self.assertEqual(contract_module.memo_cache.info()['size'], 0)
+
+    def test_eviction(self):
+        contract_module.memo_cache.resize(2)
+        try:
+            @contract('((int, int),) -> int', memo=True)
+            def f(pair):
+                return 0
+            pairs = [(i, i) for i in range(3)]
+            for pair in pairs + pairs:
+                f(pair)
+            self.assertEqual(contract_module.memo_cache.info()['evictions'], 4)
+        finally:
+            contract_module.memo_cache.resize(4096)
+
+class TestVerdictCaches(BetterTestCase):
+
+    def test_redefined_classes(self):
+        class A(object):
+            pass
+        class B(object):
+            pass
+        @contract('(^A,) -> int')
+        def f(c):
+            return 0
+        class C(A):
+            pass
+        self.assertEqual(f(C()), 0)
+        class C(B):
+            pass
+        self.assertRaisesString(FailedContract, 'expected input is (^A,), but got (%s,)' % red(red('C')), f, C())
+
+    def test_shared_names(self):
+        def make_c():
+            class C(object):
+                pass
+            return C
+        C1, C2 = make_c(), make_c()
+        @contract('(C,) -> int')
+        def f(c):
+            return 0
+        self.assertEqual(f(C1()), 0)
+        self.assertEqual(f(C2()), 0)
+        class Base(object):
+            pass
+        class D(Base):
+            pass
+        class Base(object):
+            pass
+        class E(Base):
+            pass
+        @contract('(^Base,) -> int')
+        def g(b):
+            return 0
+        self.assertEqual(g(D()), 0)
+        self.assertEqual(g(E()), 0)
+
+    def test_bounded(self):
+        @contract('(^object,) -> int')
+        def f(o):
+            return 0
+        for _ in range(2 * contract_module.verdict_cache_size):
+            class C(object):
+                pass
+            f(C())
+        self.assertTrue(len(contract_module.base_names_cache) <= contract_module.verdict_cache_size)
+
+class TestCanonicalContracts(BetterTestCase):
+
+    def test_equivalent_contracts(self):
+        @contract('(((str),) -> (str),) -> str')
+        def i_give_you_happy(f):
+            return f('happy')
+        @contract('(str,) -> str')
+        def joy_joy(s):
+            return s + ' joy joy'
+        self.assertEqual(i_give_you_happy(joy_joy), 'happy joy joy')
+        self.assertIs(joy_joy.__contract__, contract('((str), ) -> str')(lambda s: s).__contract__)
+        @contract('(int,) -> str')
+        def nope(i):
+            return ''
+        self.assertRaisesString(FailedContract, 'expected input is (((str),)->(str),), but got (%s,)' % red(red('(int,)->str')), i_give_you_happy, nope)
+
+    def test_canonical_forms(self):
+        cases = [
+            ('((a),(b))->(c)', '(a,b)->c'),
+            ('(a:(b:c),)->d', '(a:(b:c),)->d'),
+            ('((a:b):c,)->d', '((a:b):c,)->d'),
+            ('(a:(b?),)->(c?)', '(a:(b?),)->(c?)'),
+            ('((a:b)?,)->((c,)->d)', '((a:b)?,)->(c,)->d'),
+            ('(((x,)->y)?, [a:b], iter<(c)>, ^D)->(e:f)', '(((x,)->y)?,[a:b],iter<c>,^D)->(e:f)'),
+            ('((^B)?,)->(^C)?', '((^B)?,)->((^C)?)'),
+            ]
+        for s, expected in cases:
+            exprs = earley(s.replace(' ', ''))
+            self.assertEqual(len(exprs), 1)
+            self.assertEqual(contract_module.canonical(exprs[0]), expected)
+            # and it means the same thing.
+            reparsed = earley(expected)
+            self.assertEqual(len(reparsed), 1)
+            self.assertEqual(contract_module.canonical(reparsed[0]), expected)
+
+    def test_canonical_forms_reparse(self):
+        # whatever a type is, its canonical form parses (unambiguously)
+        # back into something with the same canonical form.
+        r = random.Random(11)
+        def typ(depth):
+            choice = r.randrange(10 if depth > 0 else 3)
+            if choice == 0:
+                return r.choice(['a', 'b'])
+            elif choice == 1:
+                return '^B'
+            elif choice == 2:
+                return 'iter<a>'
+            elif choice == 3:
+                return '(%s)?' % typ(depth - 1)
+            elif choice == 4:
+                return '[%s]' % typ(depth - 1)
+            elif choice == 5:
+                return '{%s}' % typ(depth - 1)
+            elif choice == 6:
+                return '(%s):(%s)' % (typ(depth - 1), typ(depth - 1))
+            elif choice == 7:
+                return '(%s,)->(%s)' % (typ(depth - 1), typ(depth - 1))
+            elif choice == 8:
+                return '(%s)' % ','.join(typ(depth - 1) for _ in range(r.randrange(2, 4)))
+            else:
+                return '(%s,)' % typ(depth - 1)
+        for _ in range(300):
+            s = '(%s,)->(%s)' % (typ(3), typ(3))
+            [tree] = earley(s)
+            expected = contract_module.canonical(tree)
+            reparsed = earley(expected)
+            self.assertEqual(len(reparsed), 1, '%s became %s' % (s, expected))
+            self.assertEqual(contract_module.canonical(reparsed[0]), expected)
+
+class TestLazyFailures(BetterTestCase):
+
+    def test_message_on_demand(self):
+        @contract('([int], str:int) -> int')
+        def f(l, d):
+            return 0
+        with self.assertRaises(FailedContract) as cm:
+            f([1, 'hi'], {'a': 1})
+        e = cm.exception
+        self.assertEqual(e.args, ('([int],str:int)', ('tuple', [(0, ('list', ('red', 'str'), False))], ('[int]', 'str:int')), 'input', None))
+        message = 'expected input is ([int],str:int), but got ([..>>>>str<<<<..],str:int,)'
+        self.assertEqual(e.message, message)
+        self.assertEqual(str(e), message)
+        self.assertEqual(pickle.loads(pickle.dumps(e)).message, message)
+
+    def test_raised_by_hand(self):
+        self.assertEqual(str(FailedContract('custom message')), 'custom message')
+        self.assertEqual(FailedContract('custom message').message, 'custom message')
+        self.assertEqual(str(FailedContract()), '')
+        self.assertEqual(str(FailedContract('a', 'b')), "('a', 'b')")
+
+    def test_where(self):
+        @contract_module.contract('(int,) -> int')
+        def f(i):
+            return i
+        with self.assertRaises(FailedContract) as cm:
+            f('hi')
+        where, message = cm.exception.message.split(': ', 1)
+        self.assertRegexpMatches(where, r'tests\.pyc? L\d+$')
+        self.assertEqual(message, 'expected input is (int,), but got (%s,)' % red(red('str')))
+
+class TestParser(BetterTestCase):
+
+    def test_ambiguous_contracts(self):
+        with self.assertRaises(AmbiguousContract):
+            contract('(a:b:c,) -> d')
+        self.assertEqual(len(earley('(int:str?,int)->C')), 2)
+        self.assertEqual(len(earley('(int:(str?),int)->C')), 1)
+
+    def test_unknown_characters(self):
+        self.assertEqual(earley('(str$,)->str'), [])
+        with self.assertRaises(InvalidContract):
+            contract('(str$,) -> str')
+
+    def test_long_contract(self):
+        s = '(' + ','.join('str:(int,[float?])' for _ in range(50)) + ') -> int'
+        @contract(s)
+        def f(*args):
+            return len(args)
+        self.assertEqual(f(*([{'a': (1, [2.0, None])}] * 50)), 50)
+
+    def test_wide_tuples(self):
+        # wider than the stack is deep.
+        n = 1500
+        s = '(%s) -> int' % ','.join(['int'] * (n - 1) + ['str'])
+        @contract(s)
+        def f(*args):
+            return len(args)
+        self.assertEqual(f(*([1] * (n - 1) + ['a'])), n)
+        self.assertRaises(FailedContract, f, *([1] * n))
+        self.assertEqual(str(f.__contract__), s.replace(' ', ''))
+
+    def test_shared_trees(self):
+        a = earley('(int,)->[int]')[0]
+        b = earley('([int],)->str')[0]
+        self.assertIs(a.rhs[2], b.rhs[0].rhs[1])
+        self.assertEqual(a.rhs[2].span, '[int]')
+        self.assertEqual(a.span, '(int,)->[int]')
+
+class TestCompiledCheckers(BetterTestCase):
+
+    def assertSameVerdict(self, s, value):
+        schema = earley(s.translate(None, ' \t\n'))[0].rhs[0]
+        def verdict(check):
+            try:
+                check(value)
+            except InternalFailedContract, e:
+                return e.args[0], contract_module.describe(e.args[1])
+            except InvalidContract, e:
+                return e.message
+        self.assertEqual(verdict(lambda v: check_value(schema, v)), verdict(compile_schema(schema)))
+
+    def test_matches_check_value(self):
+        class C(object):
+            pass
+        class D(C):
+            pass
+        cases = [
+            ('(str,) -> str', [('hi',), (5,), ()]),
+            ('() -> int', [(), (5,), [1]]),
+            ('(((),),) -> str', [((),), (), ('hi',)]),
+            ('([[int]],) -> str', [([[1]],), ([1],), ([[], ['hi']],), (None,)]),
+            ('({int},) -> str', [(set([1]),), (set(['hi']),), ([1],)]),
+            ('(int:str, int) -> str', [({5: 'hi'}, 5), ({5: 10}, 5), ({'a': 5}, 'b'), ({}, 5, 6), [1, 2]]),
+            ('(int?, ^C) -> str', [(None, D()), (5, C()), ('hi', D())]),
+            ('((str,) -> str,) -> str', [(lambda s: s,), ('hi',)]),
+            ]
+        for s, values in cases:
+            for value in values:
+                self.assertSameVerdict(s, value)
+
+class TestContractCache(BetterTestCase):
+
+    def setUp(self):
+        self.cache = contract_module.contract_cache
+        self.maxsize = self.cache.maxsize
+        self.cache.clear()
+
+    def tearDown(self):
+        self.cache.resize(self.maxsize)
+
+    def test_repeat_decoration_skips_parsing(self):
+        @contract('(str,) -> (str,) -> str')
+        def prepender(s):
+            @contract('(str,) -> str')
+            def wrapper(s2):
+                return s + s2
+            return wrapper
+        self.assertEqual(prepender('a')('b'), 'ab')
+        self.assertEqual(prepender('c')('d'), 'cd')
+        info = self.cache.info()
+        self.assertEqual((info['hits'], info['misses'], info['size']), (1, 2, 2))
+        # whitespace doesn't matter.
+        contract('(str, ) ->str')
+        self.assertEqual(self.cache.info()['hits'], 2)
+
+    def test_eviction(self):
+        self.cache.resize(2)
+        contract('(int,) -> int')
+        contract('(str,) -> int')
+        contract('(int,) -> int')
+        contract('(float,) -> int')
+        self.assertEqual(self.cache.info()['evictions'], 1)
+        contract('(str,) -> int')
+        self.assertEqual(self.cache.info()['misses'], 4)
+
+    def test_failures_are_not_cached(self):
+        for _ in range(2):
+            with self.assertRaises(InvalidContract):
+                contract('str')
+        self.assertEqual(self.cache.info()['size'], 0)
+
+class TestPrecompile(BetterTestCase):
+
+    def setUp(self):
+        contract_module.contract_cache.clear()
+        self.earley = contract_module.earley
+
+    def tearDown(self):
+        contract_module.earley = self.earley
+        contract_module.precompiled.clear()
+        contract_module.contract_cache.clear()
+
+    def test_precompiled_contracts_skip_the_parser(self):
+        source = precompile.generate(['(str,) -> str', '(int:str, int) -> C'])
+        self.assertNotIn('earley', source)
+        exec source in {}
+        def no_parsing(s):
+            raise AssertionError('parsed %r' % s)
+        contract_module.earley = no_parsing
+        @contract('(str,) -> str')
+        def exclaim(s):
+            return s + '!'
+        self.assertEqual(exclaim('hello'), 'hello!')
+        self.assertRaisesString(FailedContract, 'expected input is (str,), but got (%s,)' % red(red('int')), exclaim, 5)
+        class C(object):
+            pass
+        @contract('(int:str, int) -> C')
+        def f(m, i):
+            return C()
+        self.assertRaisesString(FailedContract, 'expected input is (int:str,int), but got ({..int:>>>>int<<<<..},int,)', f, {5: 10}, 5)
+        # anything else still gets parsed.
+        with self.assertRaises(AssertionError):
+            contract('(int,) -> str')
+
+    def test_other_versions_are_ignored(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.assertFalse(contract_module.register_precompiled('(str,)->str', 'nope', '(str,)->str', None))
+        self.assertEqual(len(caught), 1)
+        self.assertEqual(contract_module.precompiled, {})
+
+    def test_staleness(self):
+        fd, path = tempfile.mkstemp(suffix='.py')
+        os.close(fd)
+        try:
+            with open(path, 'w') as f:
+                f.write(precompile.generate(['(str,)->str', '(int,)->int']))
+            self.assertEqual(precompile.staleness(path, ['(str,)->str', '(int,)->int']), [])
+            self.assertEqual(precompile.staleness(path, ['(str,)->str', '(int,)->long']),
+                             ["missing '(int,)->long'", "no longer used '(int,)->int'"])
+        finally:
+            os.remove(path)
+
+    def test_find_contracts(self):
+        self.assertIn('(int:str,int)->C', precompile.find_contracts([__file__.replace('.pyc', '.py')]))
+
+class TestSampling(BetterTestCase):
+
+    def tearDown(self):
+        set_sampling()
+
+    def test_bad_arguments(self):
+        for kwargs in [{}, {'every': 2, 'probability': 0.5}, {'every': 0}, {'every': -1},
+                       {'probability': -0.1}, {'probability': 1.5}, {'per_second': -1}]:
+            self.assertRaises(ValueError, Sampler, **kwargs)
+        for kwargs in [{'every': 1}, {'probability': 0}, {'probability': 1}, {'per_second': 0}]:
+            Sampler(**kwargs)
+
+    def test_every(self):
+        sampler = Sampler(every=3)
+        @contract('(str,) -> str', sample_input=sampler)
+        def exclaim(s):
+            return str(s) + '!'
+        for i in range(6):
+            if i % 3 == 0:
+                self.assertRaises(FailedContract, exclaim, 5)
+            else:
+                self.assertEqual(exclaim(5), '5!')
+        self.assertEqual(sampler.info(), {'checked': 2, 'skipped': 4})
+
+    def test_input_and_output_separately(self):
+        @contract('(str,) -> str', sample_input=Sampler(probability=0.0), sample_output=Sampler(probability=1.0))
+        def f(s):
+            return s
+        self.assertEqual(f('hi'), 'hi')
+        self.assertRaisesString(FailedContract, 'expected output is str, but got %s' % red('int'), f, 5)
+
+    def test_per_second(self):
+        sampler = Sampler(per_second=2)
+        @contract('(str,) -> str', sample_input=sampler)
+        def f(s):
+            return s
+        for _ in range(10):
+            f('hi')
+        info = sampler.info()
+        self.assertEqual(info['checked'] + info['skipped'], 10)
+        # we might have crossed into the next second, but not two.
+        self.assertTrue(2 <= info['checked'] <= 4)
+
+    def test_global(self):
+        @contract('(str,) -> str')
+        def f(s):
+            return s
+        sampler = Sampler(probability=0.0)
+        set_sampling(input=sampler, output=sampler)
+        self.assertEqual(f(5), 5)
+        self.assertEqual(sampler.info(), {'checked': 0, 'skipped': 2})
+        set_sampling()
+        self.assertRaises(FailedContract, f, 5)
+
+    def test_one_policy_at_a_time(self):
+        with self.assertRaises(ValueError):
+            Sampler(every=2, probability=0.5)
+
+class TestContainerPolicy(BetterTestCase):
+
+    def setUp(self):
+        # so which elements get sampled is the same every time.
+        self.random_state = random.getstate()
+        random.seed(6)
+
+    def tearDown(self):
+        set_container_policy()
+        random.setstate(self.random_state)
+
+    def test_first(self):
+        @contract('([int], {int}, int:str) -> int', containers=ContainerPolicy(first=2))
+        def f(l, s, d):
+            return 0
+        self.assertEqual(f([1, 2, 'hi'], set([1]), {1: 'a'}), 0)
+        self.assertRaisesString(FailedContract, 'expected input is ([int],{int},int:str), but got ([..>>>>str<<<<..](partial),{int},int:str,)',
+                                f, [1, 'hi', 3], set([1]), {1: 'a'})
+        # small enough to have been checked completely.
+        self.assertRaisesString(FailedContract, 'expected input is ([int],{int},int:str), but got ([int],{int},{..int:>>>>int<<<<..},)',
+                                f, [1], set([1]), {1: 2})
+
+    def test_sample(self):
+        @contract('([int],) -> int', containers=ContainerPolicy(sample=10))
+        def f(l):
+            return 0
+        self.assertEqual(f(range(100) + ['hi']), 0)
+        self.assertRaisesString(FailedContract, 'expected input is ([int],), but got (>>[..>>>>str<<<<..](partial)<<,)', f, ['hi'] * 100)
+        self.assertRaisesString(FailedContract, 'expected input is ([int],), but got (>>[..>>>>str<<<<..]<<,)', f, [1, 'hi'])
+        @contract('(str:int,) -> int', containers=ContainerPolicy(sample=10))
+        def g(d):
+            return 0
+        self.assertRaises(FailedContract, g, dict((str(i), None) for i in range(100)))
+        @contract('({int},) -> int', containers=ContainerPolicy(sample=10))
+        def h(s):
+            return 0
+        self.assertEqual(h(set(range(100)) | set(['hi'])), 0)
+        self.assertRaisesString(FailedContract, 'expected input is ({int},), but got (>>{..>>>>str<<<<..}(partial)<<,)',
+                                h, set(str(i) for i in range(100)))
+
+    def test_reservoir_sample(self):
+        for n in [0, 5, 10, 11, 1000]:
+            sample = contract_module.reservoir_sample(iter(range(n)), 10)
+            self.assertEqual(len(sample), min(n, 10))
+            self.assertEqual(len(set(sample)), len(sample))
+            self.assertTrue(set(sample) <= set(range(n)))
+        # every element gets picked sometimes.
+        picked = set()
+        for _ in range(200):
+            picked.update(contract_module.reservoir_sample(iter(range(50)), 5))
+        self.assertEqual(picked, set(range(50)))
+
+    def test_seconds(self):
+        @contract('([int],) -> int', containers=ContainerPolicy(seconds=0.0))
+        def f(l):
+            return 0
+        # the deadline only gets looked at every so often.
+        self.assertEqual(f(range(1000) + ['hi']), 0)
+        self.assertRaises(FailedContract, f, ['hi'])
+
+    def test_seconds_only_partial_when_cut_short(self):
+        @contract('([int], {int}, int:str) -> int', containers=ContainerPolicy(seconds=10))
+        def f(l, s, d):
+            return 0
+        self.assertRaisesString(FailedContract, 'expected input is ([int],{int},int:str), but got ([..>>>>str<<<<..],{int},int:str,)',
+                                f, ['x'], set([1]), {1: 'a'})
+        self.assertRaisesString(FailedContract, 'expected input is ([int],{int},int:str), but got ([int],{..>>>>str<<<<..},int:str,)',
+                                f, [1], set(['x']), {1: 'a'})
+        self.assertRaisesString(FailedContract, 'expected input is ([int],{int},int:str), but got ([int],{int},{..int:>>>>int<<<<..},)',
+                                f, [1], set([1]), {1: 2})
+
+    def test_global(self):
+        @contract('([int],) -> int')
+        def f(l):
+            return 0
+        set_container_policy(ContainerPolicy(first=1))
+        self.assertEqual(f([1, 'hi']), 0)
+        @contract('([int],) -> int', containers=ContainerPolicy())
+        def g(l):
+            return 0
+        self.assertRaises(FailedContract, g, [1, 'hi'])
+        set_container_policy()
+        self.assertRaises(FailedContract, f, [1, 'hi'])
+
+class TestEnforcement(BetterTestCase):
+
+    def tearDown(self):
+        enforce(True)
+
+    def test_toggle_later(self):
+        @contract('(str,) -> str')
+        def f(s):
+            return s
+        self.assertRaises(FailedContract, f, 5)
+        enforce(False)
+        self.assertEqual(f(5), 5)
+        enforce(True)
+        self.assertRaises(FailedContract, f, 5)
+
+    def test_off_at_import(self):
+        def f(s):
+            return s
+        enforce(False)
+        self.assertIs(contract('(str,) -> str')(f), f)
+        # not even parsed.
+        self.assertIs(contract('not a contract')(f), f)
+
+    def test_patterns(self):
+        @contract('(str,) -> str')
+        def f(s):
+            return s
+        @contract('(str,) -> str')
+        def g(s):
+            return s
+        enforce(False, '__main__.*')
+        enforce(False, 'tests.*')
+        enforce(True, '*.g')
+        self.assertEqual(f(5), 5)
+        self.assertRaises(FailedContract, g, 5)
+        # functions wrapped from now on follow the same rules, but are
+        # still wrapped, to be switched on later.
+        @contract('(str,) -> str')
+        def h(s):
+            return s
+        self.assertEqual(h(5), 5)
+        enforce(True, '*.h')
+        self.assertRaises(FailedContract, h, 5)
+
+    def test_switched_off_functions_keep_their_contracts(self):
+        @contract('((str,) -> str,) -> str')
+        def apply(f):
+            return f('a')
+        enforce(False, '*.callback')
+        @contract('(str,) -> str')
+        def callback(s):
+            return s
+        self.assertEqual(apply(callback), 'a')
+
+    def test_registry(self):
+        @contract('(str,) -> str')
+        def registered_function(s):
+            return s
+        names = [r.name.split('.')[-1] for r in registered()]
+        self.assertIn('registered_function', names)
+        enforce(False, '*.registered_function')
+        self.assertFalse(registered_function.__registration__.enabled)
+
+    def test_environment(self):
+        contract_module.enforce_from_environment('off, *.f=on')
+        self.assertEqual(contract_module.enforcement, {'default': False, 'rules': [('*.f', True)]})
+        with self.assertRaises(ValueError):
+            contract_module.enforce_from_environment('maybe')
+
+class TestInstrumentation(BetterTestCase):
+
+    def tearDown(self):
+        set_instrumentation(False)
+        reset_instrumentation()
+
+    def test_counts(self):
+        @contract('(str,) -> str')
+        def f(s):
+            return s if s != 'bad' else 5
+        f('before')
+        set_instrumentation()
+        f('a')
+        f('b')
+        self.assertRaises(FailedContract, f, 5)
+        self.assertRaises(FailedContract, f, 'bad')
+        snapshot = instrumentation_snapshot()
+        self.assertEqual(snapshot.keys(), [('(str,)->str', f.__registration__.where)])
+        stats = snapshot.values()[0]
+        self.assertEqual(stats['calls'], 4)
+        self.assertEqual(stats['failures'], {'input': 1, 'output': 1})
+        self.assertEqual(stats['times']['input']['count'], 4)
+        self.assertEqual(stats['times']['call']['count'], 3)
+        self.assertEqual(stats['times']['output']['count'], 3)
+        self.assertEqual(sum(n for _, n in stats['times']['call']['buckets']), 3)
+
+    def test_hook(self):
+        events = []
+        @contract('(int,) -> int')
+        def f(i):
+            return i
+        set_instrumentation(hook=lambda contract, where, event: events.append((contract, event['failed'])))
+        f(1)
+        self.assertRaises(FailedContract, f, 'x')
+        self.assertEqual(events, [('(int,)->int', None), ('(int,)->int', 'input')])
+
+    def test_calls_that_raise(self):
+        @contract('(int,) -> int')
+        def f(i):
+            raise KeyError(i)
+        set_instrumentation()
+        for i in range(3):
+            self.assertRaises(KeyError, f, i)
+        stats = instrumentation_snapshot().values()[0]
+        self.assertEqual(stats['calls'], 3)
+        self.assertEqual(stats['failures'], {'input': 0, 'output': 0})
+        self.assertEqual(stats['times']['call']['count'], 3)
+        self.assertEqual(stats['times']['output']['count'], 0)
+
+    def test_broken_hook(self):
+        @contract('(int,) -> int')
+        def f(i):
+            return i
+        def hook(contract, where, event):
+            raise ValueError('broken')
+        set_instrumentation(hook=hook)
+        logger = logging.getLogger('contract')
+        logger.disabled = True
+        try:
+            self.assertEqual(f(1), 1)
+        finally:
+            logger.disabled = False
+        self.assertEqual(instrumentation_snapshot().values()[0]['calls'], 1)
+
+    def test_off(self):
+        @contract('(int,) -> int')
+        def f(i):
+            return i
+        f(1)
+        self.assertEqual(instrumentation_snapshot(), {})
+
+class TestBench(BetterTestCase):
+
+    def test_compare(self):
+        baseline = {'a': 1.0, 'b': 1.0, 'gone': 1.0}
+        self.assertEqual(bench.compare({'a': 1.2, 'b': 1.3, 'new': 5.0}, baseline), [('b', 1.0, 1.3)])
+        self.assertEqual(bench.compare({'a': 1.2}, baseline, tolerance=0.1), [('a', 1.0, 1.2)])
+
+    def test_run(self):
+        out = tempfile.TemporaryFile()
+        results = bench.run('call leaf', min_time=0.001, out=out)
+        self.assertEqual(results.keys(), ['call leaf'])
+        self.assertTrue(results['call leaf'] > 0)
+
+class TestSignatures(BetterTestCase):
+
+    def test_keywords_and_defaults(self):
+        @contract('(int, str?) -> int')
+        def f(i, s=None):
+            return i
+        self.assertEqual(f(1), 1)
+        self.assertEqual(f(1, 'a'), 1)
+        self.assertEqual(f(s='a', i=2), 2)
+        self.assertRaisesString(FailedContract, 'expected input is (int,str?), but got (int,%s,)' % red('int'), f, 1, s=2)
+        self.assertRaises(TypeError, f, 1, t='a')
+
+    def test_defaults_are_checked(self):
+        @contract('(int, str) -> int')
+        def f(i, s=5):
+            return i
+        self.assertRaisesString(FailedContract, 'expected input is (int,str), but got (int,%s,)' % red('int'), f, 1)
+
+    def test_wrong_number_of_arguments(self):
+        @contract('(int, int) -> int')
+        def add(a, b=2):
+            return a + b
+        # just like add itself, whether or not it's being checked.
+        for on in [True, False]:
+            enforce(on)
+            try:
+                self.assertRaises(TypeError, add, 1, 2, 3)
+                self.assertRaises(TypeError, add, b=3)
+            finally:
+                enforce(True)
+
+    def test_signature(self):
+        @contract('(int, str?) -> int')
+        def f(i, s=None):
+            """Does f."""
+            return i
+        self.assertEqual(inspect.getargspec(f), (['i', 's'], None, None, (None,)))
+        self.assertEqual((f.__name__, f.__doc__, f.__module__), ('f', 'Does f.', __name__))
+
+    def test_every_argument_is_reported(self):
+        @contract('(int, str, int) -> int')
+        def f(a, b, c):
+            return a
+        self.assertRaisesString(FailedContract, 'expected input is (int,str,int), but got (%s,str,%s,)' % (red('str'), red('str')), f, 'a', 'b', 'c')
+
+    def test_failures_are_not_checked_again(self):
+        # under a sample, a second look might pick other elements, and
+        # pass.
+        @contract('([int],) -> int', containers=ContainerPolicy(sample=1))
+        def f(l):
+            return 0
+        picks = iter([[1], [0], [0]])
+        sample = random.sample
+        random.sample = lambda population, k: next(picks)
+        try:
+            self.assertRaises(FailedContract, f, [1, 'a'])
+        finally:
+            random.sample = sample
+
+    def test_star_args(self):
+        @contract('(int, int) -> int')
+        def f(*args):
+            return args[0]
+        self.assertEqual(f(1, 2), 1)
+        self.assertRaises(FailedContract, f, 1, 'a')
+
+    def test_parameters_named_like_the_wrapper(self):
+        @contract('(int, str) -> str')
+        def f(f, inner):
+            return inner
+        self.assertEqual(f(1, 'a'), 'a')
+        self.assertRaises(FailedContract, f, 'a', 'a')
+
+    def test_wrappers_of_the_same_shape_are_compiled_once(self):
+        contract_module.wrapper_factories.clear()
+        def prepender(prefix):
+            @contract('(str, str) -> str')
+            def f(s, sep=prefix):
+                return sep + s
+            return f
+        hello, bye = prepender('hello, '), prepender('bye, ')
+        self.assertEqual(len(contract_module.wrapper_factories.entries), 1)
+        # each still has its own defaults and function.
+        self.assertEqual(hello('dave'), 'hello, dave')
+        self.assertEqual(bye('dave'), 'bye, dave')
+        self.assertRaises(FailedContract, prepender(5), 'dave')
+        self.assertEqual(len(contract_module.wrapper_factories.entries), 1)
+
+class TestDeferred(BetterTestCase):
+
+    def test_handler(self):
+        failures = []
+        deferred = Deferred(on_failure=failures.append)
+        @contract('(int,) -> str', defer_output=deferred)
+        def f(i):
+            return i
+        # the output isn't checked before returning,
+        self.assertEqual(f(1), 1)
+        # but it is afterwards.
+        deferred.wait()
+        self.assertEqual([e.message for e in failures], ['expected output is str, but got %s' % red('int')])
+        self.assertEqual(deferred.info(), {'checked': 1, 'failed': 1, 'dropped': 0, 'inline': 0, 'queued': 0})
+        # inputs are still checked straight away.
+        self.assertRaises(FailedContract, f, 'a')
+
+    def test_raise_on_next_call(self):
+        deferred = Deferred(on_failure='raise')
+        @contract('(int,) -> int', defer_output=deferred)
+        def f(i):
+            return i if i >= 0 else 'negative'
+        f(-1)
+        deferred.wait()
+        self.assertRaisesString(FailedContract, 'expected output is int, but got %s' % red('str'), f, 1)
+        self.assertEqual(f(1), 1)
+
+    def test_raising_still_checks_the_current_output(self):
+        deferred = Deferred(on_failure='raise')
+        @contract('(int,) -> int', defer_output=deferred)
+        def f(i):
+            return i if i >= 0 else 'negative'
+        f(-1)
+        deferred.wait()
+        # raises -1's failure, but -2's output is queued first..
+        self.assertRaises(FailedContract, f, -2)
+        deferred.wait()
+        self.assertEqual(deferred.info()['checked'], 2)
+        # ..so its failure comes out next time.
+        self.assertRaises(FailedContract, f, 1)
+        self.assertEqual(f(1), 1)
+
+    def hold_up(self, deferred):
+        # keeps deferred's worker busy until the returned event is set.
+        started, gate = threading.Event(), threading.Event()
+        deferred.queue.put((lambda value: (started.set(), gate.wait()), None, None))
+        started.wait()
+        return gate
+
+    def test_when_full(self):
+        for when_full in ['drop', 'inline']:
+            deferred = Deferred(queue_size=1, on_failure='count', when_full=when_full)
+            @contract('(int,) -> str', defer_output=deferred)
+            def f(i):
+                return i
+            gate = self.hold_up(deferred)
+            self.assertEqual(f(1), 1)
+            if when_full == 'inline':
+                self.assertRaises(FailedContract, f, 2)
+            else:
+                self.assertEqual(f(2), 2)
+            gate.set()
+            deferred.wait()
+            self.assertEqual(deferred.info()[when_full == 'inline' and 'inline' or 'dropped'], 1)
+            self.assertEqual(deferred.info()['failed'], 1)
+
+    def test_snapshot(self):
+        deferred = Deferred(snapshot=True, on_failure='count')
+        @contract('() -> [int]', defer_output=deferred)
+        def f():
+            return [1]
+        gate = self.hold_up(deferred)
+        f().append('two')
+        gate.set()
+        deferred.wait()
+        self.assertEqual(deferred.info()['failed'], 0)
+
+    def test_snapshot_of_what_cant_be_copied(self):
+        deferred = Deferred(snapshot=True, on_failure='count')
+        @contract('(int,) -> iter<int>', defer_output=deferred)
+        def count_to(n):
+            for i in range(n):
+                yield i
+        self.assertEqual(list(count_to(3)), [0, 1, 2])
+        @contract('() -> int', defer_output=deferred)
+        def f():
+            return threading.Lock()
+        self.assertRaises(FailedContract, f)
+        self.assertEqual(deferred.info()['inline'], 2)
+
+    def test_raising_never_raises_the_current_failure(self):
+        # however quickly it's checked.
+        deferred = Deferred(on_failure='raise')
+        @contract('(int,) -> int', defer_output=deferred)
+        def f(i):
+            return 'negative'
+        for _ in range(200):
+            f(-1)
+            deferred.wait()
+            deferred.pending.clear()
+
+class TestValidate(BetterTestCase):
+
+    rows = [{'a': 1}, {'a': None}, {'a': 'x'}, {}, 5]
+
+    def failures(self, *args, **kwargs):
+        return [(i, e.message) for i, e in validate('str:(int?)', *args, **kwargs)]
+
+    def test_validate(self):
+        expected = [
+            (2, 'expected value is str:(int?), but got {..str:%s..}' % red(red('str'))),
+            (4, 'expected value is str:(int?), but got %s' % red('int')),
+            ]
+        self.assertEqual(self.failures(self.rows), expected)
+        self.assertEqual(self.failures(iter(self.rows), chunk_size=2), expected)
+
+    def test_processes(self):
+        rows = self.rows * 50
+        self.assertEqual(self.failures(rows, chunk_size=7, processes=2), self.failures(rows))
+
+    def test_bad_contracts(self):
+        self.assertRaises(InvalidContract, validate, '[int', [])
+        self.assertRaises(InvalidContract, validate, 'iter<int>', [])
+
+class TestAutowrap(BetterTestCase):
+
+    def test_plain_callbacks(self):
+        @contract_module.contract('((int,) -> int, int) -> int', autowrap=True)
+        def apply(f, i):
+            return f(i)
+        def double(i):
+            return i * 2
+        def broken(i):
+            return str(i)
+        self.assertEqual(apply(double, 2), 4)
+        # the failure is the callback's, and says where it is.
+        where = '%s L%i' % (broken.func_code.co_filename, broken.func_code.co_firstlineno)
+        self.assertRaisesString(FailedContract, '%s: expected output is int, but got %s' % (where, red('str')), apply, broken, 2)
+
+    def test_any_contract(self):
+        # the wrapper is made from the canonical form of the expected
+        # contract, which has to parse.
+        class B(object):
+            pass
+        class C(B):
+            pass
+        @contract('(((^B)?,) -> int,) -> int', autowrap=True)
+        def apply(f):
+            return f(None) + f(C())
+        self.assertEqual(apply(lambda b: 1), 2)
+
+    def test_outer_options(self):
+        @contract_module.contract('((int,) -> int, int) -> int', autowrap=True, show_line=False)
+        def apply(f, i):
+            return f(i)
+        self.assertRaisesString(FailedContract, 'expected output is int, but got %s' % red('str'), apply, lambda i: str(i), 2)
+        @contract('(([int],) -> int,) -> int', autowrap=True, containers=ContainerPolicy(first=1))
+        def apply_to_list(f):
+            return f([1, 'a'])
+        self.assertEqual(apply_to_list(lambda l: len(l)), 2)
+
+    def test_wrapped_once(self):
+        callbacks = []
+        @contract('((int,) -> int,) -> int', autowrap=True)
+        def keep(f):
+            callbacks.append(f)
+            return 1
+        def double(i):
+            return i * 2
+        keep(double)
+        keep(double)
+        self.assertIs(callbacks[0], callbacks[1])
+        self.assertIsNot(callbacks[0], double)
+        self.assertRaises(FailedContract, callbacks[0], 'a')
+
+    def test_outputs(self):
+        @contract('() -> (int,) -> int', autowrap=True)
+        def make():
+            return lambda i: 'oops'
+        self.assertRaises(FailedContract, make(), 1)
+
+    def test_still_checked(self):
+        @contract('((int,) -> int,) -> int', autowrap=True)
+        def apply(f):
+            return f(1)
+        @contract('(str,) -> str')
+        def wrong(s):
+            return s
+        self.assertRaises(FailedContract, apply, wrong)
+        self.assertRaises(FailedContract, apply, 5)
+
+    def test_not_in_containers(self):
+        @contract('([(int,) -> int],) -> int', autowrap=True)
+        def apply_all(fs):
+            return len(fs)
+        self.assertRaisesString(InvalidContract, 'expected a contract-wrapped method', apply_all, [lambda i: i])
+
+    def test_opt_in(self):
+        @contract('((int,) -> int,) -> int')
+        def apply(f):
+            return f(1)
+        self.assertRaises(InvalidContract, apply, lambda i: i)
+
+    def test_functions_are_not_kept_alive(self):
+        @contract('((int,) -> int,) -> int', autowrap=True)
+        def apply(f):
+            return f(1)
+        def double(i):
+            return i * 2
+        apply(double)
+        ref = weakref.ref(double)
+        del double
+        gc.collect()
+        self.assertIs(ref(), None)
+
+class TestStackEngine(BetterTestCase):
+
+    def test_deep_values(self):
+        # deeper than Python's stack: parsing, compiling and describing
+        # what went wrong don't recurse, and nor does checking with the
+        # stack engine, but the recursive engine does.
+        depth = 2000
+        s = '(%s,) -> int' % ('[' * depth + 'int' + ']' * depth)
+        f = contract(s, engine='stack')(lambda l: 0)
+        g = contract(s, engine='recursive')(lambda l: 0)
+        good, bad = 5, 'x'
+        for _ in range(depth):
+            good, bad = [good], [bad]
+        self.assertEqual(f(good), 0)
+        with self.assertRaises(FailedContract) as cm:
+            f(bad)
+        got = red('str')
+        for _ in range(depth):
+            got = '[..' + red(got) + '..]'
+        self.assertTrue(cm.exception.message.endswith('but got (%s,)' % red(got)))
+        self.assertRaises(RuntimeError, g, good)
+        self.assertEqual(str(f.__contract__), s.replace(' ', ''))
+
+    def test_same_failures(self):
+        s = '[(int, str:[int?], {str})]'
+        check = contract_module.value_checker(s, engine='stack')
+        recursive_check = contract_module.value_checker(s, engine='recursive')
+        for value in [[(1, {'a': [1, 'x']}, set(['a']))], [(1, {'a': None}, set())], [(1, {}, set([2]))], [()]]:
+            with self.assertRaises(InternalFailedContract) as cm:
+                check(value)
+            with self.assertRaises(InternalFailedContract) as recursive_cm:
+                recursive_check(value)
+            self.assertEqual(cm.exception.args, recursive_cm.exception.args)
+
+    def test_choosing(self):
+        self.assertRaises(ValueError, set_engine, 'quantum')
+
+class StackEngine(object):
+    # runs a test case's tests with the stack engine as the default.
+
+    def setUp(self):
+        set_engine('stack')
+        super(StackEngine, self).setUp()
+
+    def tearDown(self):
+        super(StackEngine, self).tearDown()
+        set_engine('recursive')
+
+# the test cases which check values, which get run again with the stack
+# engine.
+for test_case in [TestContracts, TestHomogeneousContainers, TestIterators, TestMemo, TestVerdictCaches,
+                  TestLazyFailures, TestContainerPolicy, TestSignatures, TestValidate, TestAutowrap]:
+    name = 'Stack' + test_case.__name__
+    globals()[name] = type(name, (StackEngine, test_case), {})
+
 if __name__ == '__main__':
     unittest.main()